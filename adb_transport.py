@@ -0,0 +1,292 @@
+import re
+import socket
+import subprocess
+import threading
+
+# --- ADB TRANSPORT ---
+# Talks to the adb server (TCP 5037) directly instead of spawning `adb` per command.
+# Wire format: 4 hex digit length + payload. Server replies OKAY or FAIL + message.
+# The old subprocess path is kept as SubprocessTransport for fallback.
+
+ADB_HOST = "127.0.0.1"
+ADB_PORT = 5037
+ADB_TIMEOUT = 10.0
+
+
+class AdbError(Exception):
+    """The adb server refused a request or the connection dropped."""
+
+
+def _recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise AdbError("adb server closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk: break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _recv_into(sock, buffer):
+    """Like _recv_all, but fills `buffer` (a bytearray, grown as needed). Returns a memoryview of the data.
+
+    Once the buffer has grown to the usual payload size, reading allocates nothing.
+    The view from the previous call must be released before the buffer can grow.
+    """
+    n = 0
+    while True:
+        if n == len(buffer):
+            buffer.extend(bytes(max(n, 65536))) # Grows with slack, so an exact fit doesn't regrow
+        with memoryview(buffer) as view:
+            got = sock.recv_into(view[n:])
+        if not got: break
+        n += got
+    return memoryview(buffer)[:n]
+
+
+class AdbConnection:
+    """A single TCP connection to the adb server."""
+
+    def __init__(self, host=ADB_HOST, port=ADB_PORT, timeout=ADB_TIMEOUT):
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise AdbError(f"Cannot reach adb server at {host}:{port}: {e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def request(self, payload):
+        """Sends one request and waits for OKAY. Raises AdbError on FAIL."""
+        data = payload.encode()
+        try:
+            self.sock.sendall(b"%04x" % len(data) + data)
+            status = _recv_exact(self.sock, 4)
+        except OSError as e:
+            raise AdbError(f"{payload}: {e}")
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(f"{payload}: {self.read_message()}")
+        raise AdbError(f"{payload}: unexpected reply {status!r}")
+
+    def read_message(self):
+        """Reads a length-prefixed reply (used by host: queries and FAIL)."""
+        length = int(_recv_exact(self.sock, 4), 16)
+        return _recv_exact(self.sock, length).decode(errors="replace")
+
+    def read_all(self, buffer=None):
+        """Everything until the server closes. With `buffer` (bytearray) it is read into that instead."""
+        try:
+            if buffer is not None:
+                return _recv_into(self.sock, buffer)
+            return _recv_all(self.sock)
+        except OSError as e:
+            raise AdbError(f"Read failed: {e}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def host_query(payload, host=ADB_HOST, port=ADB_PORT):
+    """Runs a host: service (e.g. host:devices) and returns its reply text."""
+    conn = AdbConnection(host, port)
+    try:
+        conn.request(payload)
+        return conn.read_message()
+    finally:
+        conn.close()
+
+
+def list_devices(host=ADB_HOST, port=ADB_PORT):
+    """Returns [(serial, state)] from the adb server, or from `adb devices` if the socket fails."""
+    try:
+        text = host_query("host:devices", host, port)
+    except AdbError:
+        result = subprocess.run("adb devices", shell=True, capture_output=True, text=True)
+        text = "\n".join(result.stdout.strip().split("\n")[1:])
+    devices = []
+    for line in text.strip().split("\n"):
+        parts = line.split()
+        if len(parts) >= 2:
+            devices.append((parts[0], parts[1]))
+    return devices
+
+
+class SocketStream:
+    """Incremental reader over an exec: service connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        conn.sock.settimeout(None) # A static screen can keep a stream quiet for minutes
+
+    def read(self, n=65536):
+        try:
+            return self.conn.sock.recv(n)
+        except OSError:
+            return b""
+
+    def close(self):
+        self.conn.close()
+
+
+class PipeStream:
+    """Incremental reader over an `adb exec-out` subprocess."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def read(self, n=65536):
+        return self.proc.stdout.read1(n)
+
+    def close(self):
+        self.proc.kill()
+        self.proc.stdout.close()
+
+
+class SocketTransport:
+    """Device transport over the adb server socket with a persistent shell session."""
+
+    name = "socket"
+
+    def __init__(self, serial, host=ADB_HOST, port=ADB_PORT, timeout=ADB_TIMEOUT):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._shell = None
+        self._buffer = b""
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _open_service(self, service):
+        conn = AdbConnection(self.host, self.port, self.timeout)
+        try:
+            conn.request(f"host:transport:{self.serial}")
+            conn.request(service)
+        except AdbError:
+            conn.close()
+            raise
+        return conn
+
+    def check(self):
+        """Opens and closes a transport to make sure the server knows the device."""
+        self._open_service("exec:true").close()
+
+    def exec_out(self, command, buffer=None):
+        """Like `adb exec-out <command>`: raw stdout bytes, no PTY mangling.
+
+        `buffer`: optional bytearray reused across calls; a memoryview of it is returned.
+        """
+        conn = self._open_service(f"exec:{command}")
+        try:
+            return conn.read_all(buffer)
+        finally:
+            conn.close()
+
+    def open_stream(self, command):
+        """Starts `command` and returns a reader for its stdout as it arrives."""
+        return SocketStream(self._open_service(f"exec:{command}"))
+
+    def shell(self, command, seconds=0.0):
+        """Runs a command in the persistent shell session. Returns True on exit code 0.
+
+        `seconds`: how long the command itself is expected to run (e.g. a batch with
+        sleeps); the read waits that much longer than the usual timeout.
+        """
+        with self._lock:
+            if self._shell is None:
+                self._shell = self._open_service("shell:")
+                self._buffer = b""
+            self._seq += 1
+            # The exit-code marker can't match the PTY echo of the command line itself
+            marker = re.compile(rb"^:%d:(\d+)$" % self._seq)
+            line = f"{command} ; echo :{self._seq}:$?\n".encode()
+            try:
+                self._shell.sock.settimeout(self.timeout + seconds)
+                self._shell.sock.sendall(line)
+                while True:
+                    while b"\n" in self._buffer:
+                        out, self._buffer = self._buffer.split(b"\n", 1)
+                        found = marker.match(out.strip())
+                        if found:
+                            return found.group(1) == b"0"
+                    chunk = self._shell.sock.recv(4096)
+                    if not chunk:
+                        raise AdbError("Shell session closed by device")
+                    self._buffer += chunk
+            except (OSError, AdbError) as e:
+                self._close_shell()
+                raise AdbError(f"shell {command}: {e}")
+
+    def _close_shell(self):
+        if self._shell is not None:
+            self._shell.close()
+            self._shell = None
+
+    def close(self):
+        with self._lock:
+            self._close_shell()
+
+
+class SubprocessTransport:
+    """The original path: one `adb` process per command."""
+
+    name = "subprocess"
+
+    def __init__(self, serial):
+        self.serial = serial
+
+    def check(self):
+        pass
+
+    def exec_out(self, command, buffer=None):
+        # `buffer` is ignored: subprocess output always arrives as a new bytes object
+        cmd = f"adb -s {self.serial} exec-out {command}"
+        proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise AdbError(f"exec-out {command} failed ({proc.returncode})")
+        return proc.stdout
+
+    def open_stream(self, command):
+        cmd = f"adb -s {self.serial} exec-out {command}"
+        return PipeStream(subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL))
+
+    def shell(self, command, seconds=0.0):
+        # `seconds` is unused: adb itself has no read timeout here
+        # Quoted so a batched "a ; b" line runs on the device, not in the local shell
+        cmd = f'adb -s {self.serial} shell "{command}"'
+        try:
+            subprocess.run(cmd, shell=True, check=True, stdout=subprocess.DEVNULL)
+        except subprocess.CalledProcessError as e:
+            raise AdbError(f"shell {command} failed ({e.returncode})")
+        return True
+
+    def close(self):
+        pass
+
+
+def open_transport(serial, mode="auto", host=ADB_HOST, port=ADB_PORT):
+    """Returns a transport for `serial`. mode: "socket", "subprocess" or "auto"."""
+    if mode == "subprocess":
+        return SubprocessTransport(serial)
+
+    transport = SocketTransport(serial, host, port)
+    try:
+        transport.check()
+        return transport
+    except AdbError as e:
+        if mode == "socket":
+            raise
+        print(f"ADB socket transport unavailable ({e}). Falling back to adb subprocess.")
+        return SubprocessTransport(serial)
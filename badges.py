@@ -0,0 +1,109 @@
+import threading
+import cv2
+import numpy as np
+
+from matching import BUFFERS
+
+# --- NOTIFICATION BADGES ---
+# Red notification dots are found with a BGR -> "is red" lookup table, built
+# once from the same HSV ranges the old per-call inRange check used. Checking
+# a button is then one table lookup per pixel: no HSV conversion, no bounds
+# arrays. Several buttons on a frame are converted and looked up in one pass
+# over the box that spans them all (unless they are spread too far apart).
+
+# OpenCV 8-bit HSV: hue 0-180. Red wraps around 0, so two ranges.
+RED_HSV_RANGES = (
+    ((0, 100, 100), (10, 255, 255)),
+    ((170, 100, 100), (180, 255, 255)),
+)
+RED_DOT_MIN_PIXELS = 20 # More red pixels than this = notification
+UNION_MAX_WASTE = 4.0   # One pass over the spanning box only if it is at most this many times the boxes' area
+
+
+def build_lut(hsv_ranges):
+    """Flat bool table of 2**24 entries indexed by r << 16 | g << 8 | b: True if the colour is in any range.
+
+    That index is exactly a BGRA pixel read as a little-endian uint32 with the alpha byte masked off.
+    """
+    lut = np.zeros((256, 256, 256), np.bool_)
+    # One 256x256 (g, b) slice per red value keeps the build at a few MB of scratch space
+    g, b = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+    plane = np.empty((256, 256, 3), np.uint8)
+    plane[..., 0] = b
+    plane[..., 1] = g
+    for r in range(256):
+        plane[..., 2] = r
+        hsv = cv2.cvtColor(plane, cv2.COLOR_BGR2HSV)
+        mask = np.zeros((256, 256), np.uint8)
+        for lower, upper in hsv_ranges:
+            mask |= cv2.inRange(hsv, np.array(lower), np.array(upper))
+        lut[r] = mask > 0
+    return lut.reshape(-1)
+
+
+class BadgeDetector:
+    """Counts badge-coloured pixels inside button boxes. The 16 MB table is built on first use."""
+
+    def __init__(self, hsv_ranges=RED_HSV_RANGES, min_pixels=RED_DOT_MIN_PIXELS):
+        self.hsv_ranges = hsv_ranges
+        self.min_pixels = min_pixels
+        self._lut = None
+        self._lock = threading.Lock()
+
+    @property
+    def lut(self):
+        if self._lut is None:
+            with self._lock: # Fleet threads may all hit the first check at once
+                if self._lut is None:
+                    self._lut = build_lut(self.hsv_ranges)
+        return self._lut
+
+    def hits(self, roi):
+        """Bool array: True where the pixel has the badge colour. Reused buffer - read it before the next call."""
+        if roi.shape[2] == 4:
+            roi = np.ascontiguousarray(roi[..., :3])
+        h, w = roi.shape[:2]
+        # BGR -> BGRA is one SIMD pass; each pixel then reads as one uint32 table index
+        bgra = cv2.cvtColor(roi, cv2.COLOR_BGR2BGRA, dst=BUFFERS.get("badge_bgra", (h, w, 4), np.uint8))
+        keys = bgra.view(np.uint32).reshape(h, w)
+        np.bitwise_and(keys, 0xFFFFFF, out=keys)
+        return self.lut.take(keys, out=BUFFERS.get("badge_hits", (h, w), np.bool_))
+
+    def count(self, screen, box):
+        x, y, w, h = box
+        roi = screen[y:y+h, x:x+w]
+        if roi.size == 0: return 0
+        return int(np.count_nonzero(self.hits(roi)))
+
+    def counts(self, screen, boxes):
+        """Badge pixel count per box. `boxes` is a list of (x, y, w, h) or a {name: box} dict.
+
+        One cvtColor + table lookup over the box spanning all of them, then a count per box.
+        Boxes spread over most of the screen (see UNION_MAX_WASTE) are done one by one instead.
+        """
+        if isinstance(boxes, dict):
+            return dict(zip(boxes, self.counts(screen, list(boxes.values()))))
+        H, W = screen.shape[:2]
+        clipped = [(max(0, x), max(0, y), min(W, x + w), min(H, y + h)) for x, y, w, h in boxes]
+        area = sum(max(0, x1 - x0) * max(0, y1 - y0) for x0, y0, x1, y1 in clipped)
+        if len(boxes) < 2 or area == 0:
+            return [self.count(screen, box) for box in boxes]
+        ux0 = min(b[0] for b in clipped)
+        uy0 = min(b[1] for b in clipped)
+        ux1 = max(b[2] for b in clipped)
+        uy1 = max(b[3] for b in clipped)
+        if (ux1 - ux0) * (uy1 - uy0) > UNION_MAX_WASTE * area:
+            return [self.count(screen, box) for box in boxes]
+        hits = self.hits(screen[uy0:uy1, ux0:ux1])
+        return [int(np.count_nonzero(hits[y0 - uy0:y1 - uy0, x0 - ux0:x1 - ux0])) if x1 > x0 and y1 > y0 else 0
+                for x0, y0, x1, y1 in clipped]
+
+    def badges(self, screen, boxes):
+        """Like counts(), but True/False per box."""
+        counts = self.counts(screen, boxes)
+        if isinstance(counts, dict):
+            return {name: n > self.min_pixels for name, n in counts.items()}
+        return [n > self.min_pixels for n in counts]
+
+
+RED_DOTS = BadgeDetector()
@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+import cv2
+
+from adb_transport import SocketTransport
+from fake_adb import FakeAdbServer, RecordedDevice
+from matching import BUFFERS, MATCHER, RoiIndex, SceneResult, find_nearest, match_template
+from screencap import FrameBuffers, capture_command, decode_png, decode_raw
+
+# --- REPLAY BENCHMARK ---
+# Times the hot paths on recorded screenshots instead of a live emulator.
+# Usage: python bench.py <screenshots folder> [--save] [--baseline FILE]
+#   - a folder of `adb exec-out screencap -p > name.png` captures (optional
+#     `name.raw` files from plain `screencap` are used for the raw decode)
+#   - --save stores the results as the baseline; otherwise they are compared
+#     to it and the exit code is 1 if any stage got slower / allocates more.
+#   - --threads N sizes the match pool for the scene:parallel stage, which is
+#     compared to scene:sequential (one find_image-style match after another).
+#   - --soak HOURS replays that many hours of bot ticks back to back and reports
+#     traced (tracemalloc) and resident memory; exit 1 if either keeps growing.
+# Baselines are per machine: save one before a change, compare after it.
+
+BASELINE_FILE = "bench_baseline.json"
+REPEAT = 20           # Timed runs per stage per screenshot
+TIME_TOLERANCE = 0.25 # p50 may grow this much (25%) before it counts as a regression (p95: twice that)
+ALLOC_TOLERANCE = 0.10
+TICK_TEMPLATES = ["Game Over.png", "Start Battle.png", "Claim Gems.png", "X.png"] # What one tick checks
+SOAK_TICK = 30.0   # Simulated seconds per soak tick (the bot's LOOP_INTERVAL)
+SOAK_WARMUP = 10   # Ticks before the first memory reading (buffers, caches, template loads)
+SOAK_SAMPLES = 12  # Memory readings over the run
+SOAK_RSS_TOLERANCE = 0.05 # RSS may grow 5% over the run...
+SOAK_TRACED_TOLERANCE_KB = 512 # ...and traced Python memory this much
+# The fake adb server runs in this process too - its allocations aren't the bot's
+SOAK_IGNORE = [tracemalloc.Filter(False, pattern) for pattern in ("*fake_adb.py", "*socketserver.py", "*threading.py")]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def load_payloads(folder):
+    """Returns [(name, png_bytes, raw_bytes, screen)]. raw_bytes is built from the PNG if no .raw exists."""
+    payloads = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(".png"): continue
+        path = os.path.join(folder, name)
+        with open(path, "rb") as f:
+            png = f.read()
+        screen = decode_png(png)
+        if screen is None: continue
+        raw_path = os.path.splitext(path)[0] + ".raw"
+        if os.path.exists(raw_path):
+            with open(raw_path, "rb") as f:
+                raw = f.read()
+        else:
+            h, w = screen.shape[:2]
+            raw = struct.pack("<IIII", w, h, 1, 0) + cv2.cvtColor(screen, cv2.COLOR_BGR2RGBA).tobytes()
+        payloads.append((name, png, raw, screen))
+    return payloads
+
+
+class Stage:
+    """Timings and allocation peaks for one benchmarked operation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.alloc = []
+
+    def run(self, fn, repeat):
+        # Quiet: the bot prints debug lines from inside some of these
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn() # Warm-up (lazy template loads, first-call OpenCV setup)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                self.samples.append(time.perf_counter() - start)
+            # Separate pass: tracemalloc slows everything down, keep it out of the timings
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            self.alloc.append(tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+
+    def result(self):
+        return {
+            "runs": len(self.samples),
+            "p50_ms": round(percentile(self.samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(self.samples, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(self.samples, 0.99) * 1000, 3),
+            "alloc_kb": round(max(self.alloc) / 1024, 1),
+        }
+
+
+def fake_tick(transport, registry, rois, pyramid, buffers=None):
+    """One game-state / gems / X tick against a fake device, minus the sleeps and taps.
+
+    Captures into `buffers` (a FrameBuffers) like get_screen() does; a fresh one if None.
+    """
+    buffers = buffers or FrameBuffers()
+
+    def tick():
+        data = transport.exec_out(capture_command("raw"), buffers.transfer)
+        screen = buffers.keep(decode_raw(data, buffers.take()))
+        del data # Releases the transfer buffer for the next capture
+        scene = SceneResult(screen, registry, rois=rois, pyramid=pyramid)
+        for name in TICK_TEMPLATES:
+            scene.find(name)
+        return screen
+    return tick
+
+
+def rss_bytes():
+    """Resident memory of this process, or None if this platform doesn't say."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def run_soak(folder, hours):
+    """Replays `hours` of ticks (capture, scene checks, red dot, upgrade search) and tracks memory.
+
+    Returns True if traced and resident memory stayed flat after the warm-up.
+    """
+    import bot
+    ticks = max(SOAK_WARMUP + SOAK_SAMPLES, int(hours * 3600 / SOAK_TICK))
+    device = RecordedDevice("soak", folder)
+    server = FakeAdbServer([device]).start()
+    transport = SocketTransport("soak", port=server.port)
+    tick = fake_tick(transport, bot.TEMPLATES, RoiIndex(None), bot.PYRAMID_SCALES)
+    upgrade = bot.TEMPLATES.get("Generic Upgrade.png")
+    every = max(1, (ticks - SOAK_WARMUP) // SOAK_SAMPLES)
+    samples = [] # (tick, traced bytes, rss bytes)
+    print(f"Soak: {ticks} ticks = {ticks * SOAK_TICK / 3600:.1f} h of bot time, reading memory every {every}")
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(ticks):
+                if i == SOAK_WARMUP:
+                    tracemalloc.start()
+                screen = tick()
+                bot.has_red_dot(screen, 0, 0, 120, 120)
+                if upgrade is not None:
+                    h, w = screen.shape[:2]
+                    find_nearest(screen, upgrade.bgr, 0.5, (w // 2, h // 2), 600)
+                del screen
+                device.commands.clear() # The fake device's own log, not the bot's memory
+                if i >= SOAK_WARMUP and (i - SOAK_WARMUP) % every == 0:
+                    traces = tracemalloc.take_snapshot().filter_traces(SOAK_IGNORE)
+                    samples.append((i, sum(stat.size for stat in traces.statistics("filename")), rss_bytes()))
+    finally:
+        tracemalloc.stop()
+        transport.close()
+        server.stop()
+
+    print(f"{'tick':>6} {'bot time':>9} {'traced':>10} {'rss':>10}")
+    for i, traced, rss in samples:
+        rss_text = f"{rss / 2**20:7.1f} MB" if rss is not None else "      n/a"
+        print(f"{i:>6} {i * SOAK_TICK / 3600:7.2f} h {traced / 1024:7.0f} KB {rss_text}")
+    print(f"Ran in {time.perf_counter() - started:.0f}s. Match buffers: {BUFFERS.stats()}")
+
+    first, last = samples[0], samples[-1]
+    traced_growth = (last[1] - first[1]) / 1024
+    flat = traced_growth <= SOAK_TRACED_TOLERANCE_KB
+    print(f"Traced memory: {traced_growth:+.0f} KB over the run")
+    if first[2] is not None and last[2] is not None:
+        rss_growth = (last[2] - first[2]) / first[2]
+        flat = flat and rss_growth <= SOAK_RSS_TOLERANCE
+        print(f"Resident memory: {(last[2] - first[2]) / 2**20:+.1f} MB ({rss_growth:+.1%})")
+    print("Memory is flat." if flat else "Memory keeps growing!")
+    return flat
+
+
+def sequential_scene(screen, registry, pyramid):
+    """The tick templates the find_image() way: a fresh SceneResult per template, one after another."""
+    def run():
+        for name in TICK_TEMPLATES:
+            SceneResult(screen, registry, pyramid=pyramid).find(name)
+    return run
+
+
+def parallel_scene(screen, registry, pyramid):
+    """The same templates matched together on the MATCHER pool."""
+    return lambda: SceneResult(screen, registry, pyramid=pyramid).match_many(TICK_TEMPLATES)
+
+
+def run_benchmarks(folder, repeat=REPEAT, threads=None):
+    import bot # Changes the working directory - callers pass absolute paths
+    if threads: MATCHER.resize(threads) # After the import: bot sizes the pool too
+    payloads = load_payloads(folder)
+    if not payloads:
+        print(f"No PNG screenshots in {folder}")
+        sys.exit(2)
+    stages = {}
+
+    def stage(name, fn):
+        stages.setdefault(name, Stage(name)).run(fn, repeat)
+
+    templates = {name: bot.TEMPLATES.get(name) for name in bot.TEMPLATES.names()}
+    upgrade = bot.TEMPLATES.get("Generic Upgrade.png")
+    quests = bot.TEMPLATES.get("Quests.png")
+
+    for name, png, raw, screen in payloads:
+        stage("decode_png", lambda: decode_png(png))
+        stage("decode_raw", lambda: decode_raw(raw))
+
+        for tname, template in templates.items():
+            if template is None: continue
+            if template.h > screen.shape[0] or template.w > screen.shape[1]: continue
+            stage(f"match:{tname}", lambda: match_template(screen, template.bgr))
+
+        if upgrade is not None:
+            # Anchor in the middle of the screen, like a Health / Damage label would be
+            h, w = screen.shape[:2]
+            anchor = (w // 2, h // 2)
+            stage("upgrade_search", lambda: find_nearest(screen, upgrade.bgr, 0.5, anchor, 600))
+
+        stage("scene:sequential", sequential_scene(screen, bot.TEMPLATES, bot.PYRAMID_SCALES))
+        stage("scene:parallel", parallel_scene(screen, bot.TEMPLATES, bot.PYRAMID_SCALES))
+
+        if quests is not None:
+            # Red-dot check on wherever the Quests button is (or would be)
+            _, (qx, qy) = match_template(screen, quests.bgr)
+            stage("red_dot", lambda: bot.has_red_dot(screen, qx, qy, quests.w, quests.h))
+
+    # End-to-end: capture over the adb socket protocol + decode + scene checks
+    device = RecordedDevice("bench", folder)
+    server = FakeAdbServer([device]).start()
+    transport = SocketTransport("bench", port=server.port)
+    try:
+        stage("tick", fake_tick(transport, bot.TEMPLATES, RoiIndex(None), bot.PYRAMID_SCALES))
+    finally:
+        transport.close()
+        server.stop()
+
+    return {name: s.result() for name, s in stages.items()}
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, alloc_tolerance=ALLOC_TOLERANCE):
+    """Returns the list of regression messages (empty = pass)."""
+    regressions = []
+    for name, base in baseline.items():
+        now = results.get(name)
+        if now is None: continue
+        # Tails are noisier than medians, so p95 gets double the slack
+        for key, tolerance in (("p50_ms", time_tolerance), ("p95_ms", 2 * time_tolerance)):
+            if now[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {base[key]:.2f} -> {now[key]:.2f}")
+        # Small absolute slack so a few hundred bytes of bookkeeping don't fail the run
+        if now["alloc_kb"] > base["alloc_kb"] * (1 + alloc_tolerance) + 4:
+            regressions.append(f"{name}: alloc {base['alloc_kb']:.0f} KB -> {now['alloc_kb']:.0f} KB")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'Stage':<44} {'p50':>9} {'p95':>9} {'p99':>9} {'alloc':>10}  baseline p50")
+    for name, r in results.items():
+        base = baseline.get(name) if baseline else None
+        ref = f"{base['p50_ms']:9.2f} ms" if base else ""
+        print(
+            f"{name:<44} {r['p50_ms']:6.2f} ms {r['p95_ms']:6.2f} ms {r['p99_ms']:6.2f} ms "
+            f"{r['alloc_kb']:7.0f} KB  {ref}"
+        )
+    print_speedup(results)
+
+
+def print_speedup(results):
+    sequential, parallel = results.get("scene:sequential"), results.get("scene:parallel")
+    if not sequential or not parallel or not parallel["p50_ms"]: return
+    print(f"\nParallel scene on {MATCHER.threads} thread(s), {MATCHER.cores} core(s): "
+          f"{sequential['p50_ms']:.1f} -> {parallel['p50_ms']:.1f} ms p50 "
+          f"({sequential['p50_ms'] / parallel['p50_ms']:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decode / match / tick on recorded screenshots.")
+    parser.add_argument("folder", help="Folder of recorded screenshots (.png, optional .raw)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed runs per stage per screenshot")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE, help="Allowed p50 growth (0.25 = 25%%)")
+    parser.add_argument("--threads", type=int, help="Match pool size (default: one per core, max 4)")
+    parser.add_argument("--soak", type=float, metavar="HOURS", help="Memory soak: replay HOURS of ticks instead")
+    args = parser.parse_args()
+    args.baseline = os.path.abspath(args.baseline)
+
+    if args.soak:
+        sys.exit(0 if run_soak(os.path.abspath(args.folder), args.soak) else 1)
+
+    results = run_benchmarks(os.path.abspath(args.folder), args.repeat, args.threads)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+        print_results(results)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline} - run with --save to create one.")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
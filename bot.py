@@ -1,10 +1,25 @@
 import cv2
-import numpy as np
 import subprocess
 import time
 import os
 import sys
 import random
+from contextlib import contextmanager
+
+from templates import TemplateRegistry
+from adb_transport import AdbError, open_transport
+from screencap import RawFormatError, capture_command, timed_decode
+from pipeline import CapturePipeline
+from stream import StreamFrameSource
+from scheduler import Task
+from matching import MATCHER, TICK, WORKERS, SceneResult, find_all, find_nearest, to_bgr
+from session import DeviceSession, current_session, set_default_session
+from inputs import INPUT_COST
+from metrics import METRICS, start_exporters
+from badges import RED_DOTS
+from calibration import CalibrationCache, detect_scale, registry_for
+from cadence import CADENCE_MIN, Cadence
+from tracker import tracker_for
 
 # --- SETUP: Ensure ADB is found ---
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,7 +32,51 @@ if os.path.isdir(adb_dir):
 # --- CONFIGURATION ---
 IMAGES_DIR = "The Tower Buttons"
 THRESHOLD = 0.7
-DEVICE_ID = None
+ADB_TRANSPORT = "auto" # "socket" (talk to adb server on 5037), "subprocess" (spawn adb) or "auto"
+CAPTURE_MODE = "raw" # "raw" (screencap, no PNG round trip) or "png" (screencap -p)
+CAPTURE_LOG = False  # Print bytes/decode time for every capture
+# "screencap" (one capture per frame), "pipeline" (screencaps captured + decoded ahead of
+# time by a background thread - see pipeline.py) or "stream" (one screenrecord stream
+# decoded in the background, needs ffmpeg - see stream.py). screencap is always the fallback.
+FRAME_SOURCE = "screencap"
+STREAM_WAIT = 0.5 # Max seconds to wait for a frame newer than the last tap
+PIPELINE_WAIT = 5.0 # Max seconds to wait for a pipeline frame captured after the last tap
+# Spans / counters for capture, decode, matches, adb commands and handlers (metrics.py)
+METRICS_FILE = None # e.g. "metrics.jsonl" - one JSON snapshot per minute
+METRICS_PORT = None # e.g. 9109 - Prometheus text on http://127.0.0.1:9109/metrics
+
+# Big templates are matched coarse-to-fine: 1/4 size first, then refined at full size.
+# Check fidelity against the exhaustive matcher with: python check_pyramid.py <screenshots>
+PYRAMID_SCALES = {
+    "Game Over.png": 0.25,
+    "Start Battle.png": 0.25,
+    "Home.png": 0.25,
+    "Return to Game.png": 0.25,
+    "Health.png": 0.25,
+    "Damage.png": 0.25,
+}
+# Templates checked on one frame are matched concurrently on this many threads
+# (None = one per core, max 4; 1 = one after another). See matching.MatchExecutor.
+MATCH_THREADS = None
+MATCHER.resize(MATCH_THREADS)
+# Checked by the game-state / gems / X tasks: matched together when a new frame arrives
+SCENE_TEMPLATES = ("Game Over.png", "Start Battle.png", "Claim Gems.png", "X.png")
+
+# Loaded once at startup from the compiled pack (memory-mapped, shared between bot
+# processes, rebuilt when a PNG changes); a PNG edited while running is reloaded.
+# Shared by every device in fleet mode. TEMPLATE_PACK = None decodes the PNGs directly.
+TEMPLATE_PACK = "templates.pack"
+TEMPLATES = TemplateRegistry(IMAGES_DIR, pack_path=TEMPLATE_PACK, pack_scales=sorted(set(PYRAMID_SCALES.values())))
+
+# Calibration: the PNGs were cropped at one resolution. On first capture the bot
+# finds the device's scale from these anchors (cached per serial in calibration.json)
+# and matches with templates resized to it. Delete the file to recalibrate.
+CALIBRATE = True
+CALIBRATION_ANCHORS = ("Attack.png", "Defence.png", "Expand.png", "Start Battle.png", "Home.png", "Game Over.png")
+CALIBRATION_RETRY = 60 # Seconds before trying again when no anchor is on screen...
+CALIBRATION_RETRY_MAX = 900 # ...doubling up to this
+CALIBRATION_MAX_TRIES = 8   # Then give up (templates as cropped) until the screen size changes
+CALIBRATIONS = CalibrationCache()
 
 # Timers (seconds)
 GEM_INTERVAL_MIN = 180
@@ -25,97 +84,326 @@ GEM_INTERVAL_MAX = 200
 DEFENCE_INTERVAL = 120
 ATTACK_INTERVAL = 120
 QUEST_INTERVAL = 180 # Check quests every 3 minutes (Chill mode)
-LOOP_INTERVAL = 30   # Capture screen every 30 seconds (Ultra Chill)
-
-# State - Set to 0 so they trigger IMMEDIATELY on start for testing
-last_gem_time = 0
-last_defence_time = 0
-last_attack_time = 0
-last_quest_time = 0
+LOOP_INTERVAL = 30   # Check for Game Over / Start Battle every 30 seconds (Ultra Chill)
+# Adaptive cadence (cadence.py): check every CADENCE_MIN..LOOP_INTERVAL seconds instead, and skip
+# all matching while a tiny fingerprint of the screen stays the same. A change also runs the X sweep.
+ADAPTIVE_CADENCE = False
+RECONNECT_WAIT = 30 # Max seconds one call waits for a lost device (tasks retry after that)
+X_INTERVAL = 60      # Sweep for stray X (close) buttons every minute
+UPGRADE_GAP = 60     # Defence and Attack never run within 60s of each other
+ATTACK_CUTOFF = 3600 # Stop Attack upgrades 1 hour into a round
+
+# Quest menu: every Claim / Reward on screen is tapped from one capture
+QUEST_TARGETS = ("Claim.png", "Reward.png")
+SWEEP_PASSES = 5 # Capture -> tap-all rounds per sweep (the last capture only verifies)
+
+# State - lives on a DeviceSession (session.py): device, transport, frame cache,
+# learned ROIs, round timer and task timers. This is the single-device one;
+# fleet.py gives every device thread its own.
+SESSION = DeviceSession(transport_mode=ADB_TRANSPORT, capture_mode=CAPTURE_MODE, frame_source=FRAME_SOURCE)
+set_default_session(SESSION)
 
 # --- ADB & UTILS ---
 
 def get_connected_device():
-    try:
-        result = subprocess.run("adb devices", shell=True, capture_output=True, text=True)
-        lines = result.stdout.strip().split("\n")
-        for line in lines[1:]: 
-            parts = line.split()
-            if len(parts) >= 2 and parts[1] == "device":
-                return parts[0]
-    except Exception as e:
-        print(f"Error checking devices: {e}")
-    return None
+    """First ready device. Starts the device tracker, so every later outage is seen."""
+    devices = tracker_for(current_session().adb_port).snapshot()
+    return next((serial for serial, state in devices.items() if state == "device"), None)
 
 def refresh_connection():
-    """Forces a refresh of the device ID."""
-    global DEVICE_ID
-    print("Connection lost? Searching for device...")
-    DEVICE_ID = None
-    while not DEVICE_ID:
-        DEVICE_ID = get_connected_device()
-        if DEVICE_ID:
-            print(f"Reconnected: {DEVICE_ID}")
-            return True
-        print("Waiting for device...")
-        time.sleep(5)
+    """Waits (up to RECONNECT_WAIT) for the device to be ready again. Returns True once it is."""
+    session = current_session()
+    print(f"[{session.name}] Connection lost? Searching for device...")
+    METRICS.inc("reconnects", device=session.name)
+    # Fleet mode: this session belongs to one emulator, wait for THAT one
+    wanted = session.pinned_serial
+    session.serial = None
+    started = time.monotonic()
+    # Returns the moment adb reports the device (host:track-devices), no polling loop
+    serial = tracker_for(session.adb_port).wait_ready(wanted, RECONNECT_WAIT,
+                                                      cancelled=lambda: session.scheduler.stopped)
+    if serial is None:
+        print(f"[{session.name}] No device after {time.monotonic() - started:.0f}s - will retry on the next task.")
+        return False
+    session.serial = serial
+    METRICS.observe("reconnect_wait", time.monotonic() - started, device=session.name)
+    print(f"Reconnected: {session.serial}")
     return True
 
-def run_adb(command):
-    global DEVICE_ID
-    if not DEVICE_ID:
+def get_transport():
+    """Returns the transport for the current device, opening it if needed."""
+    session = current_session()
+    transport = session.transport
+    if transport is None or transport.serial != session.serial:
+        if transport: transport.close()
+        transport = open_transport(session.serial, session.transport_mode, port=session.adb_port)
+        session.transport = transport
+        print(f"[{session.name}] ADB transport: {transport.name}")
+    return transport
+
+def drop_connection():
+    """Forgets the device and its transport so the next call reconnects."""
+    session = current_session()
+    session.serial = None
+    session.frames.invalidate()
+    stop_frame_sources(session)
+    if session.transport:
+        session.transport.close()
+        session.transport = None
+
+def stop_frame_sources(session):
+    """Stops the background stream / capture pipeline, if any."""
+    if session.stream:
+        session.stream.stop()
+        session.stream = None
+    if session.pipeline:
+        session.pipeline.stop()
+        session.pipeline = None
+
+def start_stream(session, screen):
+    """Starts the background screenrecord stream at the size of a screencap frame."""
+    h, w = screen.shape[:2]
+    session.stream = StreamFrameSource(get_transport().open_stream, w, h).start()
+    print(f"[{session.name}] Frame stream started ({w}x{h})")
+
+def start_pipeline(session):
+    """Starts the background capture thread. It decodes straight into the ring's buffers."""
+    transport = get_transport()
+    transfer = bytearray() # Reused for every payload
+
+    def capture(out):
+        mode = session.capture_mode
+        with WORKERS.slot():
+            start = time.perf_counter()
+            data = transport.exec_out(capture_command(mode), transfer)
+            transfer_s = time.perf_counter() - start
+            if not data: return None
+            try:
+                screen, decode_s = timed_decode(data, mode, out)
+            except RawFormatError as e:
+                print(f"Raw capture not understood ({e}). Switching to PNG capture.")
+                session.capture_mode = "png"
+                screen = None
+        if screen is None:
+            del data # A view into `transfer`: it must be gone before the retry can grow that buffer
+            return capture(out) if session.capture_mode != mode else None
+        session.capture_stats.record(mode, len(data), transfer_s, decode_s)
+        METRICS.observe("capture", transfer_s, mode=mode, device=session.name)
+        METRICS.observe("decode", decode_s, mode=mode, device=session.name)
+        return screen
+
+    session.pipeline = CapturePipeline(capture, name=session.name).start()
+    print(f"[{session.name}] Capture pipeline started")
+    return session.pipeline
+
+def run_adb(command, seconds=0.0):
+    """Runs an adb command. `seconds`: expected device-side run time, added to the shell read timeout."""
+    session = current_session()
+    if not session.serial:
         if not refresh_connection(): return False
     
-    full_cmd = f"adb -s {DEVICE_ID} {command}"
+    # Input is about to change the screen - the cached frame is stale from here on
+    session.frames.invalidate()
+    words = command.split()
+    kind = " ".join(words[1:3] if words[0] == "shell" else words[:1]) # e.g. "input tap"
+    if " ; " in command: kind = "input batch"
     try:
-        subprocess.run(full_cmd, shell=True, check=True, stdout=subprocess.DEVNULL)
+        with METRICS.span("adb", command=kind, device=session.name):
+            transport = get_transport()
+            if command.startswith("shell "):
+                if not transport.shell(command[len("shell "):], seconds):
+                    print(f"ADB command returned an error: {command}")
+                    return False
+            else:
+                subprocess.run(f"adb -s {session.serial} {command}", shell=True, check=True, stdout=subprocess.DEVNULL)
+        session.last_input = time.monotonic()
         return True
-    except subprocess.CalledProcessError:
+    except (AdbError, subprocess.CalledProcessError):
         print("ADB command failed. Device might be disconnected.")
-        DEVICE_ID = None # Force re-check next time
+        METRICS.inc("adb_errors", device=session.name)
+        drop_connection() # Force re-check next time
         return False
 
-def get_screen():
-    global DEVICE_ID
-    if not DEVICE_ID: 
+def get_screen(max_age=None):
+    """Returns the current screen. Reuses the cached frame if it is fresh enough."""
+    session = current_session()
+    if not session.serial: 
         if not refresh_connection(): return None
         
+    cached = session.frames.get(max_age)
+    if cached is not None: return cached
+
+    stream = session.stream
+    if stream is not None and stream.alive:
+        # Streaming: newest decoded frame since the last tap, no capture round trip
+        return stream.wait_newer(session.last_input, STREAM_WAIT)
+
+    if session.frame_source == "pipeline" and session.serial:
+        pipeline = session.pipeline or start_pipeline(session)
+        if pipeline.alive:
+            # Newest frame captured after the last tap (and after an idle spell) - usually already decoded
+            handed = pipeline.handed
+            screen = pipeline.frame_after(session.last_input, PIPELINE_WAIT)
+            if screen is not None:
+                TICK.captures += pipeline.handed - handed # Only frames not handed out before
+                return screen
+        # Producer gave up or is stuck: capture directly (reconnects on adb errors)
+        
     try:
-        if not DEVICE_ID: return None
+        if not session.serial: return None
         
+        started = time.perf_counter()
         # Throttling: Wait a bit to let ADB/Emulator breathe
         time.sleep(0.5)
         
-        # RAM Capture: adb exec-out screencap -p
-        cmd = f"adb -s {DEVICE_ID} exec-out screencap -p"
-        
-        proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        if proc.returncode != 0:
-            print("ADB capture failed. forcing reconnect.")
-            DEVICE_ID = None
-            return None
+        # RAM Capture: adb exec-out screencap [-p]
+        mode = session.capture_mode
+        buffers = session.decode_buffers # Payload and frame arrays reused from capture to capture
+        with WORKERS.slot():
+            start = time.perf_counter()
+            data = get_transport().exec_out(capture_command(mode), buffers.transfer)
+            transfer_s = time.perf_counter() - start
+            if not data:
+                print("ADB capture returned no data. forcing reconnect.")
+                drop_connection()
+                return None
             
-        return cv2.imdecode(np.frombuffer(proc.stdout, np.uint8), cv2.IMREAD_COLOR)
-        
-    except subprocess.CalledProcessError:
-        print("Failed to capture screen.")
-        DEVICE_ID = None # Force re-check
+            try:
+                screen, decode_s = timed_decode(data, mode, buffers.take())
+            except RawFormatError as e:
+                print(f"Raw capture not understood ({e}). Switching to PNG capture.")
+                session.capture_mode = "png"
+                screen = None
+        if screen is None:
+            del data # A view into buffers.transfer: it must be gone before the retry can grow that buffer
+            if session.capture_mode != mode: return get_screen()
+            print("Failed to decode screen.")
+            return None
+        screen = buffers.keep(screen)
+        
+        session.capture_stats.record(mode, len(data), transfer_s, decode_s)
+        METRICS.observe("capture", transfer_s, mode=mode, device=session.name)
+        METRICS.observe("decode", decode_s, mode=mode, device=session.name)
+        TICK.captures += 1
+        session.frames.put(screen, time.perf_counter() - started)
+        if CAPTURE_LOG:
+            print(f" > Capture ({mode}): {len(data) // 1024} KB, transfer {transfer_s * 1000:.0f} ms, decode {decode_s * 1000:.1f} ms")
+        # Started once; if it dies without producing frames we simply stay on screencap
+        if session.frame_source == "stream" and session.stream is None:
+            start_stream(session, screen)
+        return screen
+        
+    except AdbError as e:
+        print(f"ADB capture failed ({e}). forcing reconnect.")
+        METRICS.inc("capture_errors", device=session.name)
+        drop_connection() # Force re-check
         return None
 
+def send_input(command, seconds=0.0):
+    """Sends one `input ...` gesture now, or queues it if a batch is open."""
+    inputs = current_session().inputs
+    if inputs.batching:
+        if not inputs.fits(INPUT_COST + seconds): flush_inputs() # Keep each round trip short
+        inputs.add(command, seconds)
+        return True
+    inputs.record(1)
+    return run_adb(f"shell {command}")
+
+@contextmanager
+def input_batch():
+    """Taps, swipes and random_sleep() pauses inside this block go to the device in ONE round trip.
+
+    Nothing is sent until the block ends, so don't capture the screen in between.
+    """
+    inputs = current_session().inputs
+    inputs.depth += 1
+    try:
+        yield inputs
+    except BaseException:
+        inputs.depth -= 1
+        if not inputs.batching: inputs.clear() # Half a sequence is worse than none
+        raise
+    inputs.depth -= 1
+    if not inputs.batching: flush_inputs()
+
+def flush_inputs():
+    inputs = current_session().inputs
+    script, gestures, seconds, host_pause = inputs.take()
+    ok = True
+    if script:
+        inputs.record(gestures)
+        if gestures > 1:
+            print(f" > Sending {gestures} gestures in one round trip")
+        ok = run_adb(f"shell {script}", seconds)
+    # The settle pause after the last gesture: nothing left to run on the device
+    if host_pause: time.sleep(host_pause)
+    return ok
+
+def templates():
+    """Template registry for the current device (rescaled if calibration found a scale)."""
+    return current_session().templates or TEMPLATES
+
+def maybe_calibrate(session):
+    """Sets session.templates to the device's scale. Cached per serial, detected once otherwise.
+
+    Called from the game-state task only: detection is a multi-scale search that can
+    take seconds, so it must not run in the middle of an input sequence.
+    """
+    screen = get_screen()
+    if screen is None: return
+    if screen.shape[:2] != session.calibrated_frame:
+        if session.calibrated_frame is not None:
+            print(f"[{session.name}] Screen size changed - recalibrating.")
+        session.scale = session.templates = None
+        session.calibrated_frame = screen.shape[:2]
+        session.calibration_tries = 0
+        session.calibration_next = None
+    if session.scale is not None or session.calibration_tries >= CALIBRATION_MAX_TRIES: return
+    now = time.monotonic()
+    if session.calibration_next is not None and now < session.calibration_next: return
+
+    scale = CALIBRATIONS.lookup(session.serial, screen.shape)
+    if scale is None:
+        found = detect_scale(screen, TEMPLATES, CALIBRATION_ANCHORS)
+        if found is None:
+            session.calibration_tries += 1
+            if session.calibration_tries >= CALIBRATION_MAX_TRIES:
+                print(f"[{session.name}] Calibration: no anchor in {session.calibration_tries} tries, "
+                      "giving up - using templates as cropped.")
+                return
+            delay = min(CALIBRATION_RETRY_MAX, CALIBRATION_RETRY * 2 ** (session.calibration_tries - 1))
+            session.calibration_next = now + delay
+            print(f"[{session.name}] Calibration: no anchor on screen yet, using templates as cropped "
+                  f"(retry in {delay:.0f}s).")
+            return
+        scale, score, anchor = found
+        CALIBRATIONS.store(session.serial, screen.shape, scale, score, anchor)
+        print(f"[{session.name}] Calibrated: template scale {scale:.2f} ({anchor} {score:.2f})")
+    session.scale = scale
+    session.templates = registry_for(TEMPLATES, scale)
+    session.scene = None # Matched with the old templates
+    if session.templates is not TEMPLATES:
+        print(f"[{session.name}] Templates rescaled x{scale:.2f}: {session.templates.preload()}")
+
 def tap_random(x, y, w, h):
     margin_w = int(w * 0.1)
     margin_h = int(h * 0.1)
     rand_x = x + random.randint(margin_w, w - margin_w)
     rand_y = y + random.randint(margin_h, h - margin_h)
     print(f" > Clicking ({rand_x}, {rand_y})")
-    run_adb(f"shell input tap {rand_x} {rand_y}")
+    send_input(f"input tap {rand_x} {rand_y}")
 
 def swipe(x1, y1, x2, y2, duration=500):
     print(f" > Swiping ({x1},{y1}) -> ({x2},{y2})")
-    run_adb(f"shell input swipe {x1} {y1} {x2} {y2} {duration}")
+    send_input(f"input swipe {x1} {y1} {x2} {y2} {duration}", duration / 1000)
 
 def random_sleep(min_s=1.0, max_s=2.0):
+    inputs = current_session().inputs
+    if inputs.batching:
+        seconds = random.uniform(min_s, max_s)
+        if not inputs.fits(seconds): flush_inputs()
+        inputs.pause(seconds) # Slept on the device if a gesture follows, else on the host at the flush
+        return
     time.sleep(random.uniform(min_s, max_s))
 
 # --- CORE LOGIC ---
@@ -124,36 +412,15 @@ def find_image(screen, image_name, threshold=0.8):
     """Finds an image on the screen. Returns (x, y, w, h) or None."""
     if screen is None: return None
     
-    path = os.path.join(IMAGES_DIR, image_name)
-    if not os.path.exists(path):
-        # Silent warning to avoid spamming console
-        return None
-        
-    template = cv2.imread(path)
-    if template is None: return None
+    # Missing files are a silent miss, to avoid spamming console
+    scene = SceneResult(screen, templates(), rois=current_session().rois, pyramid=PYRAMID_SCALES)
+    match = scene.find(image_name, threshold)
     
-    # Safety Check: Ensure dimensions and type match
-    if screen.shape[2] != template.shape[2]:
-        # Convert both to BGR if needed, but usually this means one has alpha channel
-        template = cv2.cvtColor(template, cv2.COLOR_BGRA2BGR) if template.shape[2] == 4 else template
-        screen = cv2.cvtColor(screen, cv2.COLOR_BGRA2BGR) if screen.shape[2] == 4 else screen
+    max_val = scene.scores.get(image_name)
+    if max_val is not None and max_val > 0.6: # Debug info
+         print(f"Checking {image_name}: {max_val:.2f}")
         
-    try:
-        result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        
-        if max_val > 0.6: # Debug info
-             print(f"Checking {image_name}: {max_val:.2f}")
-
-        
-        if max_val >= threshold:
-            h, w = template.shape[:2]
-            return (max_loc[0], max_loc[1], w, h)
-            
-    except cv2.error as e:
-        print(f"OpenCV Error matching {image_name}: {e}")
-        
-    return None
+    return match
 
 
 
@@ -163,7 +430,10 @@ def click_image(image_name, threshold=0.8):
     if screen is None: return False
 
     
-    match = find_image(screen, image_name, threshold)
+    return click_match(find_image(screen, image_name, threshold), image_name)
+
+def click_match(match, image_name):
+    """Clicks an already-found (x, y, w, h) box. Returns False if match is None."""
     if match:
         x, y, w, h = match
         print(f"Found {image_name} ({x},{y})")
@@ -171,6 +441,32 @@ def click_image(image_name, threshold=0.8):
         return True
     return False
 
+def tap_upgrade_near(screen, anchor, button_name, max_dist, anchor_label):
+    """Taps the upgrade button instance closest to the anchor label (within max_dist px)."""
+    tmpl = templates().get(button_name)
+    if tmpl is None: return False
+    
+    # Use a lower threshold (0.5) because the price text changes significantly
+    try:
+        with METRICS.span("upgrade_search", template=button_name):
+            best_btn, min_dist, buttons = find_nearest(to_bgr(screen), tmpl.bgr, 0.5, anchor[:2], max_dist)
+    except cv2.error as e:
+        print(f"OpenCV Error matching {button_name}: {e}")
+        return False
+    
+    if not buttons:
+        print("No Generic Upgrade buttons found.")
+        return False
+    print(f"{button_name} best match: {buttons[0][4]:.2f} ({len(buttons)} on screen)")
+    
+    if not best_btn:
+        print(f"Nearest upgrade button was too far ({int(min_dist)}px).")
+        return False
+    print(f"Found Upgrade button {int(min_dist)}px from {anchor_label}.")
+    tap_random(*best_btn[:4])
+    return True
+
+@METRICS.timed("handler", handler="handle_defence_upgrade")
 def handle_defence_upgrade():
     print("running defence upgrade sequence...")
     # 1. Click Defence Tab
@@ -188,75 +484,73 @@ def handle_defence_upgrade():
     health = find_image(screen, "Health.png", 0.7) 
     if health:
         print("Found Health label. Searching for Upgrade button...")
-        hx, hy, hw, hh = health
-        
-        path = os.path.join(IMAGES_DIR, "Generic Upgrade.png")
-        if not os.path.exists(path): return
-        template = cv2.imread(path)
-        
-        res = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-        print(f"Generic Upgrade best match: {max_val:.2f}")
-        
-        h, w = template.shape[:2]
+        # The tab is on this frame too - upgrade tap, pause and tab tap go out as one batch
+        tab = find_image(screen, "Defence.png")
         
-        locs = np.where(res >= 0.5)
-        points = list(zip(*locs[::-1]))
-        
-        best_btn = None
-        min_dist = 99999
-        
-        for pt in points:
-            dist = ((pt[0] - hx)**2 + (pt[1] - hy)**2)**0.5
-            if dist < min_dist:
-                min_dist = dist
-                best_btn = (pt[0], pt[1], w, h)
-        
-        if best_btn:
-             if min_dist < 600:
-                print(f"Found Upgrade button {int(min_dist)}px from Health.")
-                tap_random(*best_btn)
-             else:
-                print(f"Nearest upgrade button was too far ({int(min_dist)}px).")
-        else:
-            print("No Generic Upgrade buttons found.")
+        with input_batch():
+            tap_upgrade_near(screen, health, "Generic Upgrade.png", 600, "Health")
             
-        # Final confirmation click on the Tab (Only if we were actually inside)
-        random_sleep(0.5, 1.0)
-        click_image("Defence.png")
+            # Final confirmation click on the Tab (Only if we were actually inside)
+            random_sleep(0.5, 1.0)
+            click_match(tab, "Defence.png")
             
     else:
         print("Health label not found.")
 
 def has_red_dot(screen, x, y, w, h):
     """Checks if the region contains red pixels (Notification Dot)."""
-    # Crop the button area
-    roi = screen[y:y+h, x:x+w]
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-    
-    # Red has two ranges in HSV (wrap around 0/180)
-    # Range 1: 0-10 (Hue), Sat > 100, Val > 100
-    lower1 = np.array([0, 100, 100])
-    upper1 = np.array([10, 255, 255])
-    
-    # Range 2: 170-180 (Hue)
-    lower2 = np.array([170, 100, 100])
-    upper2 = np.array([180, 255, 255])
-    
-    mask1 = cv2.inRange(hsv, lower1, upper1)
-    mask2 = cv2.inRange(hsv, lower2, upper2)
-    mask = mask1 + mask2
-    
-    red_pixels = cv2.countNonZero(mask)
+    # Lookup table instead of HSV + inRange per call (badges.py);
+    # use RED_DOTS.counts(screen, boxes) to check several buttons at once
+    red_pixels = RED_DOTS.count(screen, (x, y, w, h))
     if red_pixels > 0:
         print(f" > Red Pixels found: {red_pixels}")
     
     # If we see enough red pixels, it's a notification
-    return red_pixels > 20
+    return red_pixels > RED_DOTS.min_pixels
+
+def sweep_claims(names=QUEST_TARGETS, threshold=0.7):
+    """Taps every visible Claim / Reward from ONE capture, then re-captures to verify.
+
+    Repeats while the verify capture still shows something (max SWEEP_PASSES). Returns taps made.
+    """
+    taps = 0
+    for _ in range(SWEEP_PASSES):
+        screen = get_screen()
+        if screen is None: break
+        frame = to_bgr(screen)
+        registry = templates()
+
+        def instances(name):
+            tmpl = registry.get(name)
+            if tmpl is None: return []
+            try:
+                return [(y, x, w, h, name) for x, y, w, h, _ in find_all(frame, tmpl.bgr, threshold)]
+            except cv2.error as e:
+                print(f"OpenCV Error matching {name}: {e}")
+                return []
+        # Every target on its own pool thread
+        targets = [target for found in MATCHER.map(instances, names) for target in found]
+        if not targets: break
+        # Top to bottom, left to right - all taps of a pass in one round trip
+        with input_batch():
+            for y, x, w, h, name in sorted(targets):
+                print(f"Clicked {name[:-4]}!")
+                tap_random(x, y, w, h)
+                taps += 1
+                random_sleep(0.5, 1.0)
+    return taps
 
+@METRICS.timed("handler", handler="handle_quests")
 def handle_quests(screen):
     """Complex Quest Sequence: Expand -> Quests -> Claim -> Scroll -> Return"""
-    
+    started = time.perf_counter()
+    captures = TICK.captures
+    try:
+        quest_visit(screen)
+    finally:
+        print(f"Quest visit: {TICK.captures - captures} capture(s), {time.perf_counter() - started:.1f}s")
+
+def quest_visit(screen):
     # screen = get_screen() <-- Removed! Use passed screen
     if screen is None: return
 
@@ -303,26 +597,8 @@ def handle_quests(screen):
     print("Entered Quests menu.")
     random_sleep(2.0, 3.0)
 
-    # Helper to claim all visible rewards
-    def collect_visible():
-        found_any = False
-        # Loop until no more Claim buttons
-        while True:
-            if click_image("Claim.png", threshold=0.7):
-                print("Clicked Claim!")
-                found_any = True
-                random_sleep(0.5, 1.0)
-            # Also check for 'Reward' buttons
-            elif click_image("Reward.png", threshold=0.7):
-                print("Clicked Reward!")
-                found_any = True
-                random_sleep(0.5, 1.0)
-            else:
-                break
-        return found_any
-
     # 3. Collect Initial Rewards
-    collect_visible()
+    sweep_claims()
     
     # 4. Scroll to find more
     # "click and drag the reward scroll button to scroll to the right"
@@ -338,16 +614,17 @@ def handle_quests(screen):
         # Scroll Right (Reveal content on Right) = Drag Finger LEFT
         # User said: "move to the left side"
         end_x = start_x - 500 
-        swipe(start_x, start_y, end_x, start_y, duration=1500)
-        
-        # Double swipe just in case
-        random_sleep(0.5, 1.0)
-        swipe(start_x, start_y, end_x, start_y, duration=1500)
-        
-        random_sleep(1.5, 2.5)
+        with input_batch():
+            swipe(start_x, start_y, end_x, start_y, duration=1500)
+            
+            # Double swipe just in case
+            random_sleep(0.5, 1.0)
+            swipe(start_x, start_y, end_x, start_y, duration=1500)
+            
+            random_sleep(1.5, 2.5)
         
         # 5. Collect again after scroll
-        collect_visible()
+        sweep_claims()
     else:
         print("Reward Scroll button not found.")
 
@@ -365,6 +642,7 @@ def handle_quests(screen):
     if click_image("X.png"):
         print("Clicked X button.")
 
+@METRICS.timed("handler", handler="handle_attack_upgrade")
 def handle_attack_upgrade():
     print("running attack upgrade sequence...")
     # 1. Click Attack Tab
@@ -382,153 +660,166 @@ def handle_attack_upgrade():
     damage = find_image(screen, "Damage.png", 0.7) 
     if damage:
         print("Found Damage label. Searching for Upgrade button...")
-        dx, dy, dw, dh = damage
         
-        # Use the specific button the user created for Damage
-        path = os.path.join(IMAGES_DIR, "generic damage upgrade button.png")
-        if not os.path.exists(path): return
-        template = cv2.imread(path)
-        if template is None: return
+        tab = find_image(screen, "Attack.png")
         
-        res = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-        print(f"Damage Upgrade best match: {max_val:.2f}")
+        with input_batch():
+            # Use the specific button the user created for Damage
+            # Relax distance check slightly for Attack tab
+            tap_upgrade_near(screen, damage, "generic damage upgrade button.png", 800, "Damage")
 
-        h, w = template.shape[:2]
-        
-        # Use a lower threshold (0.5) because the price text changes significantly
-        locs = np.where(res >= 0.5)
-        points = list(zip(*locs[::-1]))
-        
-        best_btn = None
-        min_dist = 99999
-        
-        for pt in points:
-            dist = ((pt[0] - dx)**2 + (pt[1] - dy)**2)**0.5
-            if dist < min_dist:
-                min_dist = dist
-                best_btn = (pt[0], pt[1], w, h)
-        
-        if best_btn:
-             # Relax distance check slightly for Attack tab
-             if min_dist < 800:
-                print(f"Found Upgrade button {int(min_dist)}px from Damage.")
-                tap_random(*best_btn)
-             else:
-                print(f"Nearest upgrade button was too far ({int(min_dist)}px).")
-        else:
-            print("No Generic Upgrade buttons found.")
-
-        # Final confirmation click on the Tab (Only if we were actually inside)
-        random_sleep(0.5, 1.0)
-        click_image("Attack.png")
+            # Final confirmation click on the Tab (Only if we were actually inside)
+            random_sleep(0.5, 1.0)
+            click_match(tab, "Attack.png")
             
     else:
         print("Damage label not found.")
 
+def current_scene():
+    """SceneResult for the current screen. Reused by every check until the frame changes."""
+    session = current_session()
+    screen = get_screen()
+    if screen is None: return None
+    if session.scene is None or session.scene.source is not screen:
+        session.scene = SceneResult(screen, templates(), rois=session.rois, pyramid=PYRAMID_SCALES)
+        # Only worth it when they run side by side; inline they'd just cost unneeded matches
+        if MATCHER.parallel: session.scene.match_many(SCENE_TEMPLATES)
+    return session.scene
+
+def start_round():
+    print("Battle Started. Resetting Round Timer.")
+    current_session().round_start_time = time.time()
+
+# --- SCHEDULED TASKS ---
+# Returning a number from a task overrides its next interval (seconds).
+
+def screen_unchanged(name):
+    """Adaptive cadence: True if the screen looks the same as when `name` last matched on it."""
+    session = current_session()
+    if session.cadence is None: return False
+    screen = get_screen()
+    return screen is not None and not session.cadence.changed(name, screen)
+
+def check_game_state():
+    """Game-state task. With ADAPTIVE_CADENCE it only matches when the screen changed."""
+    session = current_session()
+    if CALIBRATE: maybe_calibrate(session) # Before matching: it may swap the template set
+    cadence = session.cadence
+    if cadence is None: return game_state_check()
+
+    cpu = time.process_time()
+    since = cadence.checked(time.monotonic())
+    if screen_unchanged("game_state"):
+        METRICS.inc("ticks_skipped", device=session.name)
+        return cadence.record(False, time.process_time() - cpu)
+    METRICS.inc("ticks_matched", device=session.name)
+    session.scheduler.reschedule("x_sweep", 0) # Something changed - could be a popup
+    override = game_state_check(since)
+    interval = cadence.record(True, time.process_time() - cpu)
+    return override if override is not None else interval
+
+def game_state_check(since_last=None):
+    """CRITICAL: Game Over -> Home -> Start Battle, or Start Battle from the main menu."""
+    scene = current_scene()
+    if scene is None: return 5 # No screen - try again soon
+
+    if scene.find("Game Over.png"):
+        print("Game Over detected!")
+        if since_last:
+            # It appeared at most one interval ago
+            current_session().cadence.reactions.append(since_last)
+            METRICS.observe("game_over_reaction", since_last, device=current_session().name)
+        # Home sits on the Game Over screen, so match it on the same frame
+        if click_match(scene.find("Home.png"), "Home.png"):
+            print("Going Home...")
+            random_sleep(2.0, 3.0)
+            click_image("Start Battle.png")
+            start_round()
+            random_sleep(2.0, 3.0)
+            return 0 # Check again right away on a fresh frame
+
+    if click_match(scene.find("Start Battle.png"), "Start Battle.png"):
+        start_round()
+        random_sleep(2.0, 3.0)
+        return 0
+
+# Gems and X are not gated by the fingerprint: a Claim Gems button or an X popup
+# changes far fewer blocks than CHANGE_FRACTION. They keep their own intervals
+# (and a game-state change still pulls the X sweep forward).
+
+def collect_gems():
+    scene = current_scene()
+    if scene is None: return
+    if click_match(scene.find("Claim Gems.png", threshold=0.8), "Claim Gems.png"):
+        print("Gems Claimed!")
+
+def close_popups():
+    scene = current_scene()
+    if scene is None: return
+    if click_match(scene.find("X.png"), "X.png"):
+        print("Clicked X (Scheduled).")
+
+def run_quests():
+    handle_quests(get_screen())
+
+def attack_allowed():
+    """Attack upgrades only run for the first hour of the round."""
+    if time.time() - current_session().round_start_time < ATTACK_CUTOFF:
+        return True
+    print(" > 1 Hour Limit reached: Skipping Attack Upgrade.")
+    return False
+
+def build_scheduler(scheduler):
+    """Registers every routine. Drift (jitter) keeps the timings human-looking."""
+    session = current_session()
+    session.cadence = Cadence(CADENCE_MIN, LOOP_INTERVAL) if ADAPTIVE_CADENCE else None
+    scheduler.add(Task("game_state", check_game_state, CADENCE_MIN if ADAPTIVE_CADENCE else LOOP_INTERVAL, priority=0))
+    scheduler.add(Task("gems", collect_gems, (GEM_INTERVAL_MIN, GEM_INTERVAL_MAX), jitter=5, priority=1))
+    scheduler.add(Task("x_sweep", close_popups, X_INTERVAL, jitter=5, priority=2))
+    scheduler.add(Task("defence", handle_defence_upgrade, DEFENCE_INTERVAL, jitter=5, priority=3,
+                       gap_group="upgrade", gap=UPGRADE_GAP))
+    # Past the cutoff Attack is skipped (retried in 2 mins) and does NOT hold up Defence
+    scheduler.add(Task("attack", handle_attack_upgrade, ATTACK_INTERVAL, jitter=5, priority=4,
+                       gap_group="upgrade", gap=UPGRADE_GAP, allowed=attack_allowed, retry=120))
+    scheduler.add(Task("quests", run_quests, QUEST_INTERVAL, jitter=10, priority=5))
+    scheduler.before_run = TICK.start
+    scheduler.after_run = lambda ran: print(f"[{current_session().name}] Ran {', '.join(ran)} | {TICK.summary()}")
+    return scheduler
+
 def main():
     print(f"Bot starting in: {script_dir}")
     print(f"Images folder: {IMAGES_DIR}")
+    print(f"Templates loaded: {TEMPLATES.preload()}")
     print("Press Ctrl+C to stop.")
     
-    global DEVICE_ID, last_gem_time, last_defence_time, last_attack_time, last_quest_time, last_x_time, last_action_time
-    DEVICE_ID = get_connected_device()
-    if DEVICE_ID: print(f"Connected: {DEVICE_ID}")
+    SESSION.serial = get_connected_device()
+    if SESSION.serial: print(f"Connected: {SESSION.serial}")
     else: return
 
-    # Stagger Upgrades so they happen 1 minute apart
-    # Defence triggers immediately (0), Attack triggers in 60s (current - 60 < 120 check)
-    current_t = time.time()
-    last_action_time = 0 # Track when the LAST major upgrade happened
-    round_start_time = current_t # Track when this SPECIFIC round started
+    SESSION.round_start_time = time.time()
+    build_scheduler(SESSION.scheduler)
+    stop_metrics = start_exporters(METRICS_FILE, METRICS_PORT)
     
-    # Initialize normally - the "Gap" logic will handle the staggering naturally
-    last_defence_time = 0 
-    last_attack_time = 0 
-    last_x_time = 0 
-
-    while True:
-        try:
-            current_time = time.time()
-            
-            # Get screen ONCE per loop to be efficient
-            screen = get_screen()
-            if screen is None: continue 
-
-            # --- 1. CRITICAL: Game Over / Restart ---
-            if find_image(screen, "Game Over.png"):
-                print("Game Over detected!")
-                if click_image("Home.png"):
-                    print("Going Home...")
-                    random_sleep(2.0, 3.0)
-                    click_image("Start Battle.png")
-                    print("Battle Started. Resetting Round Timer.")
-                    round_start_time = time.time() # Reset logic info
-                    random_sleep(2.0, 3.0)
-                    continue 
-            
-            if find_image(screen, "Start Battle.png"):
-                 click_image("Start Battle.png")
-                 print("Battle Started. Resetting Round Timer.")
-                 round_start_time = time.time()
-                 random_sleep(2.0, 3.0)
-            
-
-
-
-            
-            # --- 2. GEMS ---
-            if current_time - last_gem_time > random.randint(GEM_INTERVAL_MIN, GEM_INTERVAL_MAX):
-                if click_image("Claim Gems.png", threshold=0.8):
-                    print("Gems Claimed!")
-                # Add slight fuzz (-5s to +5s) to the reset time so it drifts
-                last_gem_time = current_time + random.randint(-5, 5)
-            
-            # --- 3. DEFENCE UPGRADES (Priority 1) ---
-            # Run if Interval passed AND we haven't done another action recently (Gap > 60s)
-            if (current_time - last_defence_time > DEFENCE_INTERVAL) and \
-               (current_time - last_action_time > 60):
-                handle_defence_upgrade()
-                # Drift the next check by +/- 5 seconds
-                last_defence_time = current_time + random.randint(-5, 5)
-                last_action_time = current_time
-
-            # --- 4. ATTACK UPGRADES (Priority 2) ---
-            # Run if Interval passed AND Gap > 60s
-            # AND: Only runs for the first hour (3600s) of the round
-            if (current_time - last_attack_time > ATTACK_INTERVAL) and \
-               (current_time - last_action_time > 60):
-               
-               if (current_time - round_start_time < 3600):
-                   handle_attack_upgrade()
-                   # Drift the next check by +/- 5 seconds
-                   last_attack_time = current_time + random.randint(-5, 5)
-                   last_action_time = current_time
-               else:
-                   print(" > 1 Hour Limit reached: Skipping Attack Upgrade.")
-                   # Still update the timer so we don't spam this message every loop
-                   # But DO NOT update last_action_time, so Defence can run freely
-                   last_attack_time = current_time + 120 # Check again in 2 mins
-            
-            # --- 5. QUESTS (Way more chill - check every few mins) ---
-            if current_time - last_quest_time > QUEST_INTERVAL:
-                handle_quests(screen)
-                last_quest_time = current_time + random.randint(-10, 10)
-
-            # --- 6. X BUTTON (Check every 1 minute) ---
-            if current_time - last_x_time > 60:
-                if click_image("X.png"):
-                    print("Clicked X (Scheduled).")
-                last_x_time = current_time + random.randint(-5, 5)
-
-            time.sleep(LOOP_INTERVAL)
-
-        except KeyboardInterrupt:
-            print("\nStopped.")
-            break
-        except Exception as e:
-            print(f"Error: {e}")
-            time.sleep(2)
+    # Sleeps exactly until the next task is due - no fixed polling loop
+    try:
+        SESSION.scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+        print(SESSION.scheduler.report())
+        print(SESSION.capture_stats.summary())
+        print(f"ROI index: {SESSION.rois.stats()}")
+        print(f"Frame cache: {SESSION.frames.stats()}")
+        print(f"Input: {SESSION.inputs.stats()}")
+        print(f"Match pool: {MATCHER.stats()}")
+        if SESSION.cadence:
+            print(f"Adaptive cadence: {SESSION.cadence.stats()}")
+        print(f"Devices: {tracker_for(SESSION.adb_port).stats()}")
+        if SESSION.stream:
+            print(f"Frame stream: {SESSION.stream.stats()}")
+        if SESSION.pipeline:
+            print(f"Capture pipeline: {SESSION.pipeline.stats()}")
+        stop_frame_sources(SESSION)
+        stop_metrics()
 
 if __name__ == "__main__":
     main()
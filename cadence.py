@@ -0,0 +1,97 @@
+import time
+import cv2
+import numpy as np
+
+# --- ADAPTIVE CADENCE ---
+# Instead of full template matching every LOOP_INTERVAL, the game-state check
+# wakes up often and first compares a tiny fingerprint of the frame (block means
+# of a 24x48 downscale, ~1 ms) with the frame it last matched on. No change ->
+# no matching, and the next wake-up backs off. A change -> match right away and
+# go back to the shortest interval. Small animations (projectiles, enemies)
+# move a few blocks a little; popups and the Game Over screen move many a lot.
+
+FINGERPRINT_SIZE = (24, 48)  # (w, h) - portrait, like the game
+BLOCK_DELTA = 12.0   # A block "changed" if its mean moved by more than this (0-255)
+CHANGE_FRACTION = 0.05 # Frame changed if at least this fraction of blocks did
+CADENCE_MIN = 3.0    # Seconds between checks right after a change
+CADENCE_BACKOFF = 1.5 # Interval growth per unchanged check (up to the max)
+
+
+def fingerprint(screen):
+    """Block means of the frame as a small float32 grayscale array."""
+    small = cv2.resize(screen, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = small[..., :3].mean(axis=2, dtype=np.float32)
+    return small.astype(np.float32, copy=False)
+
+
+def changed_fraction(a, b):
+    """Fraction of blocks that moved by more than BLOCK_DELTA between two fingerprints."""
+    return float(np.count_nonzero(np.abs(a - b) > BLOCK_DELTA)) / a.size
+
+
+class Cadence:
+    """Change detection + check interval for one device, with skip / CPU / reaction counters.
+
+    CPU time is time.process_time(), so it includes the pool and capture threads
+    (and, in fleet mode, the other devices' work done at the same time).
+    """
+
+    def __init__(self, min_interval=CADENCE_MIN, max_interval=30.0, backoff=CADENCE_BACKOFF):
+        self.min_interval = min_interval
+        self.max_interval = max_interval # The fixed loop's interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self._seen = {} # check name -> fingerprint of the frame it last matched on
+        self.checks = 0
+        self.skipped = 0
+        self.cpu_matched = 0.0 # CPU seconds of checks that matched
+        self.cpu_skipped = 0.0 # ... and of checks that stopped at the fingerprint
+        self.last_check = None # time.monotonic() of the previous game-state check
+        self.reactions = []    # Seconds Game Over was visible at most before it was seen
+        self.started_at = time.monotonic()
+
+    def changed(self, name, screen):
+        """True if `screen` differs from the frame `name` last matched on (and remembers it).
+
+        The reference is only replaced on a change, so slow drift still adds up.
+        """
+        current = fingerprint(screen)
+        previous = self._seen.get(name)
+        if previous is not None and previous.shape == current.shape:
+            if changed_fraction(previous, current) < CHANGE_FRACTION: return False
+        self._seen[name] = current
+        return True
+
+    def record(self, matched, cpu_s):
+        """Books one check. Returns the seconds until the next one."""
+        self.checks += 1
+        if matched:
+            self.cpu_matched += cpu_s
+            self.interval = self.min_interval
+        else:
+            self.skipped += 1
+            self.cpu_skipped += cpu_s
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def checked(self, now):
+        """Marks a game-state check. Returns the seconds since the previous one."""
+        since = now - self.last_check if self.last_check is not None else 0.0
+        self.last_check = now
+        return since
+
+    def stats(self):
+        hours = max(1e-9, (time.monotonic() - self.started_at) / 3600)
+        matched = self.checks - self.skipped
+        per_match = self.cpu_matched / matched if matched else 0.0
+        return {
+            "checks": self.checks,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / self.checks, 3) if self.checks else 0.0,
+            "interval_s": round(self.interval, 1),
+            "cpu_s_per_hour": round((self.cpu_matched + self.cpu_skipped) / hours, 1),
+            # What matching on every fixed-loop tick would have cost at the same per-match CPU
+            "fixed_loop_cpu_s_per_hour": round(per_match * 3600 / self.max_interval, 1),
+            "game_over_reaction_s": round(sum(self.reactions) / len(self.reactions), 1) if self.reactions else None,
+        }
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+from matching import match_template
+from templates import Template
+
+# --- RESOLUTION CALIBRATION ---
+# The button PNGs were cropped at one emulator resolution. On a device with a
+# different size / DPI they silently never match. Calibration finds the device's
+# scale factor ONCE by matching a few anchor templates over a range of scales,
+# caches it per serial, and from then on every template is served pre-resized
+# at that one scale - no per-tick multi-scale search.
+
+CALIBRATION_FILE = "calibration.json"
+CALIBRATION_SCALES = np.arange(0.5, 2.01, 0.1) # Coarse pass
+CALIBRATION_COARSE = 0.25  # The coarse pass runs on a 1/4-size frame
+CALIBRATION_REFINE = 0.02  # Then +/- 3 steps of this around the best coarse scale, full size
+CALIBRATION_MIN_SCORE = 0.8 # An anchor must match at least this well to trust the scale
+SCALE_TOLERANCE = 0.03     # Closer than this to 1.0 -> use the templates as they are
+
+
+def _resize(image, scale):
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def _best_scale(screen, template, scales):
+    """(score, scale, (x, y)) of the best match of `template` resized by each of `scales`."""
+    best = (-1.0, None, None)
+    for scale in scales:
+        resized = _resize(template, scale)
+        if resized.shape[0] < 8 or resized.shape[1] < 8: continue
+        if resized.shape[0] > screen.shape[0] or resized.shape[1] > screen.shape[1]: continue
+        score, loc = match_template(screen, resized)
+        if score > best[0]:
+            best = (score, float(scale), loc)
+    return best
+
+
+def detect_scale(screen, registry, anchors):
+    """Finds the template scale that fits this frame.
+
+    Returns (scale, score, anchor), or None if no anchor matched well at any scale.
+    """
+    # Coarse: every anchor at every scale on a 1/4-size frame (template scale s -> s / 4)
+    small = _resize(screen, CALIBRATION_COARSE)
+    best = None
+    for name in anchors:
+        template = registry.get(name)
+        if template is None: continue
+        _, scale, loc = _best_scale(small, template.bgr, CALIBRATION_SCALES * CALIBRATION_COARSE)
+        if scale is None: continue
+        scale /= CALIBRATION_COARSE
+
+        # Refine at full size, only in a window around the coarse hit (cheap)
+        top = scale + 3 * CALIBRATION_REFINE
+        margin = int(max(template.w, template.h) * top)
+        x0 = max(0, int(loc[0] / CALIBRATION_COARSE) - margin)
+        y0 = max(0, int(loc[1] / CALIBRATION_COARSE) - margin)
+        window = screen[y0:y0 + 3 * margin, x0:x0 + 3 * margin]
+        fine = [scale + CALIBRATION_REFINE * step for step in range(-3, 4)]
+        score, scale, _ = _best_scale(window, template.bgr, fine)
+        if scale is not None and (best is None or score > best[1]):
+            best = (round(scale, 3), score, name)
+    if best is None or best[1] < CALIBRATION_MIN_SCORE:
+        return None
+    return best
+
+
+class ScaledRegistry:
+    """Serves every template of `base` resized by `scale`, built once per template.
+
+    Drop-in for TemplateRegistry (get / names / preload / stats). A template that
+    is reloaded from disk in the base registry is re-scaled on its next get().
+    """
+
+    def __init__(self, base, scale):
+        self.base = base
+        self.scale = scale
+        self._scaled = {} # name -> (base Template, scaled Template)
+
+    def names(self):
+        return self.base.names()
+
+    def get(self, name):
+        template = self.base.get(name)
+        if template is None: return None
+        cached = self._scaled.get(name)
+        if cached is not None and cached[0] is template:
+            return cached[1]
+        scaled = Template(name, template.path, template.mtime, _resize(template.bgr, self.scale))
+        self._scaled[name] = (template, scaled)
+        return scaled
+
+    def preload(self):
+        """Loads and rescales every template. Returns how many are ready."""
+        return sum(1 for name in self.names() if self.get(name) is not None)
+
+    def stats(self):
+        stats = self.base.stats()
+        stats["scale"] = self.scale
+        stats["scaled"] = len(self._scaled)
+        return stats
+
+
+class CalibrationCache:
+    """serial -> {"scale", "score", "anchor", "frame": [h, w], "at"}, kept in CALIBRATION_FILE."""
+
+    def __init__(self, path=CALIBRATION_FILE):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock() # Fleet devices may calibrate at the same time
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable calibration file {path}: {e}")
+
+    def lookup(self, serial, frame_shape):
+        """Cached scale for this device, or None if unknown or its frame size changed."""
+        entry = self.entries.get(serial)
+        if entry is None or entry["frame"] != list(frame_shape[:2]):
+            return None
+        return entry["scale"]
+
+    def store(self, serial, frame_shape, scale, score, anchor):
+        with self._lock:
+            self.entries[serial] = {
+                "scale": scale, "score": round(score, 3), "anchor": anchor,
+                "frame": list(frame_shape[:2]), "at": int(time.time()),
+            }
+            if not self.path: return
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(self.entries, f, indent=1)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Could not save calibration: {e}")
+
+
+def registry_for(base, scale):
+    """The registry to match with at `scale`: the base one itself when it's ~1.0."""
+    if abs(scale - 1.0) < SCALE_TOLERANCE:
+        return base
+    return ScaledRegistry(base, scale)
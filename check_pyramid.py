@@ -0,0 +1,71 @@
+import os
+import sys
+import cv2
+
+from templates import TemplateRegistry
+from matching import match_pyramid, match_template
+
+# Compares the pyramid matcher against the exhaustive one on saved screenshots.
+# Usage: python check_pyramid.py <screenshots folder> [scale]
+#   - with no scale: checks the templates listed in bot.PYRAMID_SCALES
+#   - with a scale:  checks EVERY template at that scale
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "The Tower Buttons")
+SCORE_TOLERANCE = 0.02 # Max allowed score difference
+PIXEL_TOLERANCE = 2    # Max allowed box offset
+ON_SCREEN = 0.7        # Only compare when the exhaustive matcher says the template is on screen
+
+
+def load_screens(folder):
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(".png"):
+            screen = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+            if screen is not None:
+                yield name, screen
+
+
+def check(folder, scales):
+    registry = TemplateRegistry(IMAGES_DIR)
+    failures = 0
+    checked = 0
+    for screen_name, screen in load_screens(folder):
+        for name, scale in scales.items():
+            template = registry.get(name)
+            if template is None: continue
+            if template.h > screen.shape[0] or template.w > screen.shape[1]: continue
+
+            exact_score, exact_loc = match_template(screen, template.bgr)
+            fast_score, fast_loc = match_pyramid(screen, template.bgr, scale)
+            checked += 1
+
+            score_diff = abs(exact_score - fast_score)
+            offset = max(abs(exact_loc[0] - fast_loc[0]), abs(exact_loc[1] - fast_loc[1]))
+            # Off-screen peaks are arbitrary - only a real match has to agree
+            bad = exact_score >= ON_SCREEN and (score_diff > SCORE_TOLERANCE or offset > PIXEL_TOLERANCE)
+            if bad:
+                failures += 1
+            print(
+                f"{'FAIL' if bad else ' ok '} {screen_name} | {name} @ {scale}: "
+                f"exhaustive {exact_score:.3f} {exact_loc}, pyramid {fast_score:.3f} {fast_loc}"
+            )
+
+    print(f"\n{checked} comparisons, {failures} outside tolerance.")
+    return failures == 0
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python check_pyramid.py <screenshots folder> [scale]")
+        sys.exit(2)
+    folder = os.path.abspath(sys.argv[1]) # Importing bot changes into the bot folder
+    if len(sys.argv) > 2:
+        scale = float(sys.argv[2])
+        scales = {name: scale for name in TemplateRegistry(IMAGES_DIR).names()}
+    else:
+        from bot import PYRAMID_SCALES
+        scales = PYRAMID_SCALES
+    sys.exit(0 if check(folder, scales) else 1)
+
+
+if __name__ == "__main__":
+    main()
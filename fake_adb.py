@@ -0,0 +1,232 @@
+import os
+import re
+import socketserver
+import struct
+import sys
+import threading
+
+import cv2
+
+# --- FAKE ADB SERVER ---
+# A tiny stand-in for the adb server so the socket transport can be exercised
+# without an emulator. Speaks just enough of the protocol:
+#   host:version, host:devices, host:track-devices, host:transport:<serial>, exec:<cmd>, shell:
+#
+# Device state changes (set_state / add_device / remove_device) are pushed to
+# every open host:track-devices connection, like the real server does.
+#
+# Usage: python fake_adb.py [port] [screenshot.png]
+
+
+class FakeDevice:
+    """What a fake serial answers with. Override / replace attributes as needed."""
+
+    def __init__(self, serial, screencap=b"", state="device"):
+        self.serial = serial
+        self.state = state
+        self.screencap = screencap # Bytes returned for `screencap` commands
+        self.commands = []         # Every exec/shell command received, in order
+
+    def run(self, command):
+        """Returns (stdout_bytes, exit_code) for a command."""
+        self.commands.append(command)
+        if command.startswith("screencap"):
+            return self.screencap, 0
+        return b"", 0
+
+
+class RecordedDevice(FakeDevice):
+    """Serves a folder of recorded screenshots in a loop, one per capture.
+
+    `screencap -p` gets the PNG bytes, plain `screencap` gets a raw RGBA
+    payload with the 16-byte header, like a real Android 12+ device.
+    """
+
+    def __init__(self, serial, frames_dir, state="device"):
+        super().__init__(serial, state=state)
+        self.png_frames = []
+        self.raw_frames = []
+        for name in sorted(os.listdir(frames_dir)):
+            if not name.lower().endswith(".png"): continue
+            with open(os.path.join(frames_dir, name), "rb") as f:
+                data = f.read()
+            image = cv2.imread(os.path.join(frames_dir, name), cv2.IMREAD_COLOR)
+            if image is None: continue
+            h, w = image.shape[:2]
+            rgba = cv2.cvtColor(image, cv2.COLOR_BGR2RGBA)
+            self.png_frames.append(data)
+            self.raw_frames.append(struct.pack("<IIII", w, h, 1, 0) + rgba.tobytes())
+        if not self.png_frames:
+            raise ValueError(f"No PNG frames in {frames_dir}")
+        self.index = 0
+        self._lock = threading.Lock()
+
+    def run(self, command):
+        with self._lock:
+            self.commands.append(command)
+            if not command.startswith("screencap"):
+                return b"", 0
+            i = self.index % len(self.png_frames)
+            self.index += 1
+        frames = self.png_frames if "-p" in command.split() else self.raw_frames
+        return frames[i], 0
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def _reply_ok(self, message=None):
+        if message is None:
+            self.request.sendall(b"OKAY")
+        else:
+            data = message.encode()
+            self.request.sendall(b"OKAY" + b"%04x" % len(data) + data)
+
+    def _reply_fail(self, message):
+        data = message.encode()
+        self.request.sendall(b"FAIL" + b"%04x" % len(data) + data)
+
+    def _read_request(self):
+        header = self._recv_exact(4)
+        if header is None: return None
+        body = self._recv_exact(int(header, 16))
+        return body.decode() if body is not None else None
+
+    def _recv_exact(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk: return None
+            data += chunk
+        return data
+
+    def handle(self):
+        server = self.server
+        device = None
+        while True:
+            payload = self._read_request()
+            if payload is None: return
+            server.requests.append(payload)
+
+            if payload == "host:version":
+                self._reply_ok("0029")
+                return
+            if payload == "host:devices":
+                self._reply_ok(server.device_list())
+                return
+            if payload == "host:track-devices":
+                self._reply_ok()
+                self._track_devices()
+                return
+            if payload.startswith("host:transport:"):
+                device = server.devices.get(payload[len("host:transport:"):])
+                if device is None or device.state != "device":
+                    self._reply_fail("device not found")
+                    return
+                self._reply_ok()
+                continue
+            if device is None:
+                self._reply_fail(f"unknown request {payload}")
+                return
+            if payload.startswith("exec:"):
+                self._reply_ok()
+                out, _ = device.run(payload[len("exec:"):])
+                self.request.sendall(out)
+                return
+            if payload == "shell:":
+                self._reply_ok()
+                self._interactive_shell(device)
+                return
+            self._reply_fail(f"unknown service {payload}")
+            return
+
+    def _track_devices(self):
+        """Sends the device list now and again after every change, until either side closes."""
+        server = self.server
+        sent = None
+        while not server.closing:
+            with server.changed:
+                server.changed.wait_for(lambda: server.version != sent or server.closing, timeout=0.5)
+                if server.version == sent: continue
+                sent = server.version
+                data = server.device_list().encode()
+            try:
+                self.request.sendall(b"%04x" % len(data) + data)
+            except OSError:
+                return
+
+    def _interactive_shell(self, device):
+        marker = re.compile(r"^(.*) ; echo :(\d+):\$\?$")
+        buffer = b""
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk: return
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                found = marker.match(line.decode().strip())
+                if not found: continue
+                out, code = device.run(found.group(1))
+                self.request.sendall(out + f":{found.group(2)}:{code}\r\n".encode())
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """Threaded fake adb server. Use port=0 to get a free port (see .port)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, devices=(), host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.devices = {d.serial: d for d in devices}
+        self.requests = []
+        self.changed = threading.Condition() # Notified on every device list change
+        self.version = 0
+        self.closing = False
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def device_list(self):
+        return "".join(f"{d.serial}\t{d.state}\n" for d in list(self.devices.values()))
+
+    def _notify(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def add_device(self, device):
+        self.devices[device.serial] = device
+        self._notify()
+
+    def remove_device(self, serial):
+        self.devices.pop(serial, None)
+        self._notify()
+
+    def set_state(self, serial, state):
+        """e.g. "offline" to simulate a dropped emulator, "device" to bring it back."""
+        self.devices[serial].state = state
+        self._notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.closing = True # Ends open track-devices streams
+        self._notify()
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5037
+    screencap = open(sys.argv[2], "rb").read() if len(sys.argv) > 2 else b""
+    server = FakeAdbServer([FakeDevice("emulator-5554", screencap)], port=port)
+    print(f"Fake adb server on 127.0.0.1:{server.port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
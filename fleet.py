@@ -0,0 +1,130 @@
+import argparse
+import re
+import threading
+import time
+
+import bot
+from adb_transport import ADB_PORT
+from matching import MATCHER, WORKERS
+from metrics import start_exporters
+from session import DeviceSession, use_session
+from tracker import tracker_for
+
+# --- FLEET MODE ---
+# Drives several emulators from ONE process. Each device gets its own
+# DeviceSession (connection, timers, round state) and thread; templates are
+# shared, and capture/match work is capped by a bounded worker pool.
+#
+# Usage:
+#   python fleet.py                      - every connected device
+#   python fleet.py emulator-5554 ...    - just these serials
+#   python fleet.py --fake 10 --frames <screenshots folder> --duration 120
+#                                        - 10 fake devices serving recorded frames
+
+FLEET_WORKERS = 4 # Captures / matches allowed to run at the same time
+
+
+def roi_file_for(serial):
+    return "roi_index_" + re.sub(r"[^\w.-]", "_", serial) + ".json"
+
+
+def run_device(session):
+    """Thread body: binds the session to this thread and runs its scheduler."""
+    use_session(session)
+    scheduler = session.scheduler
+    scheduler.sleep = scheduler.wait # Wake up early when the fleet stops
+    bot.build_scheduler(scheduler)
+    try:
+        scheduler.run_forever()
+    except Exception as e:
+        print(f"[{session.name}] Device thread crashed: {e}")
+    finally:
+        bot.stop_frame_sources(session)
+        if session.transport:
+            session.transport.close()
+
+
+def print_summary(sessions):
+    print("\n--- FLEET SUMMARY ---")
+    for session in sessions:
+        print(session.summary())
+    print(f"Worker pool: {WORKERS.size} slots, {WORKERS.waits} waits, {WORKERS.wait_time:.1f}s queued")
+    print(f"Match pool: {MATCHER.stats()}")
+    for port in sorted({session.adb_port for session in sessions}):
+        print(f"Devices: {tracker_for(port).stats()}")
+
+
+def run_fleet(serials, workers=FLEET_WORKERS, duration=None, adb_port=ADB_PORT,
+              transport_mode=bot.ADB_TRANSPORT, capture_mode=bot.CAPTURE_MODE, persist_rois=True,
+              frame_source=bot.FRAME_SOURCE):
+    """Runs one session per serial until Ctrl+C (or `duration` seconds). Returns the sessions."""
+    print(f"Templates loaded: {bot.TEMPLATES.preload()}")
+    WORKERS.resize(workers)
+    tracker_for(adb_port) # Tracking from the start, so even the first outage counts as one
+
+    sessions = [
+        DeviceSession(serial, pinned=True, roi_file=roi_file_for(serial) if persist_rois else None,
+                      adb_port=adb_port, transport_mode=transport_mode, capture_mode=capture_mode,
+                      frame_source=frame_source)
+        for serial in serials
+    ]
+    threads = [
+        threading.Thread(target=run_device, args=(session,), name=f"device-{session.name}", daemon=True)
+        for session in sessions
+    ]
+    stop_metrics = start_exporters(bot.METRICS_FILE, bot.METRICS_PORT)
+    print(f"Fleet: {len(sessions)} device(s), {workers} worker slots. Press Ctrl+C to stop.")
+    for thread in threads:
+        thread.start()
+
+    try:
+        deadline = time.time() + duration if duration else None
+        while any(t.is_alive() for t in threads):
+            if deadline and time.time() >= deadline: break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping fleet...")
+    finally:
+        for session in sessions:
+            session.scheduler.stop()
+        for thread in threads:
+            thread.join(timeout=10)
+        stop_metrics()
+        print_summary(sessions)
+    return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot on several emulators at once.")
+    parser.add_argument("serials", nargs="*", help="Device serials (default: every connected device)")
+    parser.add_argument("--workers", type=int, default=FLEET_WORKERS, help="Concurrent capture/match slots")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    parser.add_argument("--fake", type=int, metavar="N", help="Run N fake devices instead (needs --frames)")
+    parser.add_argument("--frames", help="Folder of recorded screenshots for the fake devices")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fake_adb import FakeAdbServer, RecordedDevice
+        if not args.frames:
+            parser.error("--fake needs --frames")
+        devices = [RecordedDevice(f"fake-{i:02d}", args.frames) for i in range(args.fake)]
+        bot.CALIBRATIONS.path = None # Don't remember fake serials
+        server = FakeAdbServer(devices).start()
+        print(f"Fake adb server on port {server.port}")
+        try:
+            run_fleet([d.serial for d in devices], args.workers, args.duration, adb_port=server.port,
+                      transport_mode="socket", persist_rois=False)
+        finally:
+            server.stop()
+        return
+
+    devices = tracker_for(ADB_PORT).snapshot()
+    serials = args.serials or [serial for serial, state in devices.items() if state == "device"]
+    if not serials:
+        print("Error: No devices found! Make sure the emulators are running.")
+        return
+    run_fleet(serials, args.workers, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import time
+
+# --- FRAME SOURCES ---
+# Keeps the last capture around so back-to-back reads don't each pay for a
+# screencap. Any tap/swipe invalidates it, because the screen is about to change.
+
+FRAME_TTL = 1.0 # Seconds a capture stays fresh enough to reuse
+
+
+class FrameCache:
+    """The latest frame plus hit / time-saved counters."""
+
+    def __init__(self, ttl=FRAME_TTL):
+        self.ttl = ttl
+        self.frame = None
+        self.taken_at = 0.0
+        self.hits = 0          # Reads served from the cache (= captures avoided)
+        self.captures = 0      # Real captures stored
+        self.invalidations = 0
+        self.capture_time = 0.0 # Total seconds spent in real captures
+
+    def get(self, max_age=None):
+        """Returns the cached frame if it is younger than max_age (default: ttl), else None."""
+        if self.frame is None: return None
+        if max_age is None:
+            max_age = self.ttl
+        if time.monotonic() - self.taken_at > max_age:
+            return None
+        self.hits += 1
+        return self.frame
+
+    def put(self, frame, capture_s=0.0):
+        self.frame = frame
+        self.taken_at = time.monotonic()
+        self.captures += 1
+        self.capture_time += capture_s
+
+    def invalidate(self):
+        if self.frame is not None:
+            self.invalidations += 1
+        self.frame = None
+
+    def stats(self):
+        avg = self.capture_time / self.captures if self.captures else 0.0
+        return {
+            "captures": self.captures,
+            "cache_hits": self.hits,
+            "captures_avoided": self.hits,
+            "time_saved_s": round(self.hits * avg, 2),
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,83 @@
+# --- INPUT BATCHING ---
+# While a batch is open (bot.input_batch()), taps, swipes and the random pauses
+# between them are queued instead of sent. On close they go to the device as ONE
+# shell line - "input tap ..; sleep 0.73; input swipe .." - so the pauses happen
+# on the device and the whole sequence costs a single round trip.
+# Offsets and pause lengths are still randomized per gesture, as before.
+# Pauses at the END of a batch are slept on the host after the round trip:
+# nothing follows them on the device, so they would only stretch the read.
+
+# A batch is one shell read. Its timeout is ADB_TIMEOUT plus the batch's estimated
+# device-side time, and a gesture or pause that would take the batch past this
+# starts a new one, so no single read waits much longer than this.
+BATCH_MAX_SECONDS = 6.0
+INPUT_COST = 1.0 # Rough seconds for one `input` command to start and run (slow on emulators)
+
+
+class InputQueue:
+    """Pending device-side input commands plus gestures-per-round-trip counters."""
+
+    def __init__(self):
+        self.pending = []
+        self.pauses = []
+        self.gestures_pending = 0
+        self.seconds_pending = 0.0 # Estimated device-side run time of the queue
+        self.depth = 0 # Open (possibly nested) batches
+        self.gestures = 0
+        self.round_trips = 0
+
+    @property
+    def batching(self):
+        return self.depth > 0
+
+    def fits(self, seconds):
+        """True if `seconds` more device time keeps the batch within BATCH_MAX_SECONDS.
+
+        An empty batch takes anything - one long gesture is still one round trip.
+        """
+        return not self.pending or self.seconds_pending + seconds <= BATCH_MAX_SECONDS
+
+    def add(self, command, seconds=0.0):
+        """Queues one gesture, e.g. "input tap 10 20". `seconds`: how long the gesture itself lasts."""
+        self.pending.append(command)
+        self.gestures_pending += 1
+        self.seconds_pending += INPUT_COST + seconds
+
+    def pause(self, seconds):
+        """Queues a device-side pause between gestures."""
+        self.pending.append(f"sleep {seconds:.2f}")
+        self.pauses.append(seconds)
+        self.seconds_pending += seconds
+
+    def take(self):
+        """Returns (shell line, gesture count, device seconds, host pause) and clears the queue.
+
+        Trailing pauses are left out of the shell line and returned as the host pause.
+        """
+        pending = self.pending
+        host_pause = 0.0
+        while pending and pending[-1].startswith("sleep "):
+            pending = pending[:-1]
+            host_pause += self.pauses.pop()
+        script = " ; ".join(pending)
+        gestures = self.gestures_pending
+        seconds = self.seconds_pending - host_pause
+        self.clear()
+        return script, gestures, seconds, host_pause
+
+    def clear(self):
+        self.pending = []
+        self.pauses = [] # Seconds of each queued sleep, in order
+        self.gestures_pending = 0
+        self.seconds_pending = 0.0
+
+    def record(self, gestures):
+        self.gestures += gestures
+        self.round_trips += 1
+
+    def stats(self):
+        return {
+            "gestures": self.gestures,
+            "round_trips": self.round_trips,
+            "gestures_per_round_trip": round(self.gestures / self.round_trips, 2) if self.round_trips else 0.0,
+        }
@@ -0,0 +1,575 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# --- TEMPLATE MATCHING ---
+# Every cv2.matchTemplate call in the bot goes through match_template(),
+# so the per-tick counters below see all of them.
+
+DEFAULT_THRESHOLD = 0.8
+
+# ROI index: search near the last hit first, full frame only on a miss
+ROI_FILE = "roi_index.json"
+ROI_PAD_FACTOR = 0.5 # Padding around the last hit, as a fraction of the template size
+ROI_PAD_MIN = 20     # ...but never less than this many pixels
+ROI_MAX_SCALE = 8    # Padding can widen up to this many times on repeated moves
+
+# Pyramid matching: coarse pass on a downscaled frame, refine the best peaks at full size
+PYRAMID_CANDIDATES = 3 # Coarse peaks refined at full resolution
+PYRAMID_MIN_SIZE = 8   # Downscaled template smaller than this -> exhaustive instead
+
+# Multi-instance matching
+NMS_OVERLAP = 0.3 # Boxes overlapping a better one by more than this (IoU) are duplicates
+
+# Scratch buffers: matchTemplate results and peak masks are written
+# into arrays kept per thread and reused on the next frame of the same size
+MATCH_BUFFER_SLOTS = 64 # (purpose, shape) entries kept per thread, least recently used dropped...
+MATCH_BUFFER_BYTES = 16 * 1024 * 1024 # ...and at most this many bytes per thread (bigger arrays aren't kept)
+
+# Parallel matching: independent templates on one frame share a small thread pool
+MATCH_THREADS_MAX = 4 # Default pool size is one thread per core, up to this
+
+
+class TickStats(threading.local):
+    """Counts captures and matchTemplate passes between two start() calls.
+
+    Thread-local, so each device in fleet mode counts only its own work.
+    """
+
+    def __init__(self):
+        self.captures = 0
+        self.matches = 0
+
+    def start(self):
+        self.captures = 0
+        self.matches = 0
+
+    def summary(self):
+        return f"{self.captures} capture(s), {self.matches} match(es)"
+
+
+TICK = TickStats()
+
+
+class WorkerPool:
+    """Bounded pool of worker slots for CPU-heavy capture / match work.
+
+    Unlimited until resize() is called (fleet mode sets it), so the
+    single-device bot pays nothing for it.
+    """
+
+    def __init__(self, size=None):
+        self.waits = 0       # Times a thread had to queue for a slot
+        self.wait_time = 0.0 # Total seconds spent queueing
+        self.resize(size)
+
+    def resize(self, size):
+        self.size = size
+        self._sem = threading.BoundedSemaphore(size) if size else None
+
+    @contextmanager
+    def slot(self):
+        sem = self._sem
+        if sem is None:
+            yield
+            return
+        if not sem.acquire(blocking=False):
+            start = time.perf_counter()
+            sem.acquire()
+            self.waits += 1
+            self.wait_time += time.perf_counter() - start
+        try:
+            yield
+        finally:
+            sem.release()
+
+
+WORKERS = WorkerPool()
+
+
+class MatchBuffers(threading.local):
+    """Reusable scratch arrays keyed by (purpose, shape, dtype), one set per thread.
+
+    Frames and templates keep the same sizes from tick to tick, so after the first
+    frame every matchTemplate / dilate / compare writes into an array that already exists.
+    Only for results consumed before the call returns - never hand one out.
+
+    Capped by count and by bytes: every device and pool thread has its own set, and
+    full-frame results (~8 MB each at 1080x1920) would otherwise pile up per template.
+    """
+
+    def __init__(self, slots=MATCH_BUFFER_SLOTS, max_bytes=MATCH_BUFFER_BYTES):
+        self.slots = slots
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.nbytes = 0
+        self.allocations = 0
+        self.reuses = 0
+
+    def get(self, purpose, shape, dtype=np.float32):
+        key = (purpose, tuple(shape), np.dtype(dtype).char)
+        array = self.arrays.get(key)
+        if array is not None:
+            self.arrays.move_to_end(key)
+            self.reuses += 1
+            return array
+        array = np.empty(shape, dtype)
+        self.allocations += 1
+        if array.nbytes > self.max_bytes // 4:
+            return array # Too big to keep - freed after the call, as without the cache
+        self.arrays[key] = array
+        self.nbytes += array.nbytes
+        while len(self.arrays) > self.slots or self.nbytes > self.max_bytes:
+            _, dropped = self.arrays.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+        return array
+
+    def result(self, image, template, purpose="result"):
+        """float32 matchTemplate output buffer for this image / template size (None if it doesn't fit)."""
+        if not fits(image, template): return None # matchTemplate raises its own cv2.error
+        (ih, iw), (th, tw) = image.shape[:2], template.shape[:2]
+        return self.get(purpose, (ih - th + 1, iw - tw + 1))
+
+    def stats(self):
+        return {"buffers": len(self.arrays), "allocations": self.allocations, "reuses": self.reuses,
+                "kb": self.nbytes // 1024}
+
+
+BUFFERS = MatchBuffers()
+
+
+class MatchExecutor:
+    """Thread pool for independent matches on one frame. map() returns results in input order.
+
+    matchTemplate releases the GIL, so N templates really run on N cores.
+    OpenCV's own worker threads are capped at cores // threads while the pool
+    exists, so pool x OpenCV threads doesn't oversubscribe the CPU.
+    With one thread (or one core) everything runs inline, as before.
+    """
+
+    def __init__(self, threads=None):
+        self.cores = os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+        self._worker = threading.local() # Set on pool threads: nested map() runs inline
+        self.batches = 0 # map() calls that went to the pool
+        self.tasks = 0
+        self.resize(threads)
+
+    def resize(self, threads):
+        """None = one thread per core (max MATCH_THREADS_MAX)."""
+        self.shutdown()
+        self.threads = max(1, threads or min(MATCH_THREADS_MAX, self.cores))
+
+    @property
+    def parallel(self):
+        return self.threads > 1
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                cv2.setNumThreads(max(1, self.cores // self.threads))
+                self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="match",
+                                                initializer=self._mark_worker)
+            return self._pool
+
+    def _mark_worker(self):
+        self._worker.active = True
+
+    def _counted(self, fn, item):
+        # TICK is per thread: hand the pool thread's match count back to the caller
+        before = TICK.matches
+        result = fn(item)
+        return result, TICK.matches - before
+
+    def map(self, fn, items):
+        """[fn(item) for item in items], run concurrently. The first exception is re-raised."""
+        items = list(items)
+        if not self.parallel or len(items) < 2 or getattr(self._worker, "active", False):
+            return [fn(item) for item in items]
+        pool = self._get_pool()
+        futures = [pool.submit(self._counted, fn, item) for item in items]
+        results = []
+        for future in futures:
+            result, matches = future.result()
+            TICK.matches += matches
+            results.append(result)
+        self.batches += 1
+        self.tasks += len(items)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is None: return
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            cv2.setNumThreads(-1) # Back to OpenCV's default
+
+    def stats(self):
+        return {"threads": self.threads, "batches": self.batches,
+                "tasks_per_batch": round(self.tasks / self.batches, 1) if self.batches else 0.0}
+
+
+MATCHER = MatchExecutor()
+
+
+def to_bgr(screen):
+    """Templates are always BGR, so strip alpha from the screen if present."""
+    if screen.ndim == 3 and screen.shape[2] == 4:
+        return cv2.cvtColor(screen, cv2.COLOR_BGRA2BGR)
+    return screen
+
+
+def fits(image, template):
+    """True if `template` fits inside `image` - matchTemplate needs that."""
+    return template.shape[0] <= image.shape[0] and template.shape[1] <= image.shape[1]
+
+
+def match_template(screen, template):
+    """One TM_CCOEFF_NORMED pass. Returns (score, (x, y)) of the best match.
+
+    A template bigger than the screen scores -1.0 (no match).
+    """
+    if not fits(screen, template): return -1.0, (0, 0)
+    TICK.matches += 1
+    with WORKERS.slot():
+        result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED, result=BUFFERS.result(screen, template))
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    return max_val, max_loc
+
+
+def nms_peaks(result, threshold, w, h, overlap=NMS_OVERLAP):
+    """De-duplicated peaks of a matchTemplate result. Returns [(x, y, w, h, score)], best first.
+
+    Local maxima are picked with one dilate pass, then greedy NMS runs on the
+    (few) survivors with numpy instead of looping over every pixel.
+    The full-size masks are written into BUFFERS, only the peak lists are new.
+    """
+    # A pixel is a candidate only if it's the max of its half-template neighbourhood
+    kernel = np.ones((max(1, h // 2) | 1, max(1, w // 2) | 1), np.uint8)
+    dilated = cv2.dilate(result, kernel, dst=BUFFERS.get("dilated", result.shape))
+    peaks = cv2.compare(result, dilated, cv2.CMP_GE, dst=BUFFERS.get("peaks", result.shape, np.uint8))
+    strong = cv2.compare(result, threshold, cv2.CMP_GE, dst=BUFFERS.get("strong", result.shape, np.uint8))
+    cv2.bitwise_and(peaks, strong, dst=peaks)
+    points = cv2.findNonZero(peaks) # (x, y) per peak, or None
+    if points is None:
+        return []
+    points = points.reshape(-1, 2) # (n, 1, 2) or (n, 2) depending on the OpenCV version
+    xs, ys = points[:, 0], points[:, 1]
+    scores = result[ys, xs]
+
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        # All boxes are the template size, so IoU only depends on the offsets
+        ix = np.maximum(0, w - np.abs(xs[rest] - xs[i]))
+        iy = np.maximum(0, h - np.abs(ys[rest] - ys[i]))
+        inter = ix * iy
+        iou = inter / (2 * w * h - inter)
+        order = rest[iou <= overlap]
+    return [(int(xs[i]), int(ys[i]), w, h, float(scores[i])) for i in keep]
+
+
+def find_all(frame, template, threshold, overlap=NMS_OVERLAP):
+    """Every instance of `template` scoring >= threshold. Returns [(x, y, w, h, score)], best first."""
+    if not fits(frame, template): return []
+    TICK.matches += 1
+    h, w = template.shape[:2]
+    with WORKERS.slot():
+        result = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED, result=BUFFERS.result(frame, template))
+        return nms_peaks(result, threshold, w, h, overlap)
+
+
+def nearest_to(instances, anchor):
+    """Instance whose top-left is closest to anchor (x, y). Returns (instance, distance) or (None, None)."""
+    if not instances:
+        return None, None
+    points = np.array([inst[:2] for inst in instances], np.float64)
+    dist = np.hypot(points[:, 0] - anchor[0], points[:, 1] - anchor[1])
+    i = int(np.argmin(dist))
+    return instances[i], float(dist[i])
+
+
+def find_nearest(frame, template, threshold, anchor, radius):
+    """find_all + nearest_to in one go.
+
+    Returns (instance, distance, instances). `instance` is None when nothing
+    lies within `radius`; `distance` is still the nearest one for logging.
+    """
+    instances = find_all(frame, template, threshold)
+    best, dist = nearest_to(instances, anchor)
+    if best is None or dist >= radius:
+        return None, dist, instances
+    return best, dist, instances
+
+
+def downscale(image, scale):
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def match_pyramid(screen, template, scale, small_screen=None, small_template=None,
+                  candidates=PYRAMID_CANDIDATES):
+    """Coarse-to-fine version of match_template(). Same return value.
+
+    Finds the best few peaks on a `scale`-sized copy of frame and template, then
+    re-matches a small full-resolution window around each one. Pass in
+    precomputed small images to avoid resizing them on every call.
+    """
+    if not fits(screen, template): return -1.0, (0, 0)
+    th, tw = template.shape[:2]
+    if small_template is None:
+        small_template = downscale(template, scale)
+    sth, stw = small_template.shape[:2]
+    if min(sth, stw) < PYRAMID_MIN_SIZE:
+        return match_template(screen, template)
+    if small_screen is None:
+        small_screen = downscale(screen, scale)
+    if not fits(small_screen, small_template): # Rounding of the two resizes
+        return match_template(screen, template)
+
+    TICK.matches += 1
+    with WORKERS.slot():
+        coarse = cv2.matchTemplate(small_screen, small_template, cv2.TM_CCOEFF_NORMED,
+                                   result=BUFFERS.result(small_screen, small_template, "coarse"))
+
+    # A coarse pixel covers 1/scale full pixels, plus rounding from the resize
+    margin = int(2 / scale) + 1
+    fh, fw = screen.shape[:2]
+    best_score, best_loc = -1.0, (0, 0)
+    for _ in range(candidates):
+        _, peak, _, (cx, cy) = cv2.minMaxLoc(coarse)
+        if peak <= -1.0: break # Everything left was suppressed
+
+        x, y = int(cx / scale), int(cy / scale)
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(fw, x + tw + margin), min(fh, y + th + margin)
+        score, (rx, ry) = match_template(screen[y0:y1, x0:x1], template)
+        if score > best_score:
+            best_score, best_loc = score, (x0 + rx, y0 + ry)
+
+        # Suppress this peak so the next candidate is a different spot
+        coarse[max(0, cy - sth // 2):cy + sth // 2 + 1, max(0, cx - stw // 2):cx + stw // 2 + 1] = -1.0
+    return best_score, best_loc
+
+
+class RoiIndex:
+    """Remembers where each template was last found and searches there first.
+
+    Learned regions survive restarts (ROI_FILE). A region is dropped when the
+    frame size changes, and widened each time the template turns up outside it.
+    """
+
+    def __init__(self, path=ROI_FILE):
+        self.path = path
+        self.entries = {} # name -> {"box": [x, y, w, h], "frame": [h, w], "scale": n}
+        self.hits = 0          # Found inside the learned region
+        self.misses = 0        # Region searched, nothing there -> full frame
+        self.full_scans = 0    # Full-frame matchTemplate passes
+        self.matches = 0       # All matchTemplate passes made through the index
+        self.pixels = 0        # Search-image pixels fed to matchTemplate
+        self._lock = threading.Lock() # Templates of one frame may be searched in parallel
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path): return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable ROI index {self.path}: {e}")
+            self.entries = {}
+
+    def save(self):
+        if not self.path: return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not save ROI index: {e}")
+
+    def region(self, name, frame_shape):
+        """Returns the padded (x0, y0, x1, y1) search region for `name`, or None."""
+        entry = self.entries.get(name)
+        if entry is None: return None
+        fh, fw = frame_shape[:2]
+        if entry["frame"] != [fh, fw]:
+            return None
+        x, y, w, h = entry["box"]
+        pad = int(max(ROI_PAD_MIN, ROI_PAD_FACTOR * max(w, h)) * entry["scale"])
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(fw, x + w + pad), min(fh, y + h + pad)
+        if x1 - x0 < w or y1 - y0 < h:
+            return None
+        return x0, y0, x1, y1
+
+    def record(self, name, box, frame_shape, widen=False):
+        with self._lock:
+            entry = self.entries.get(name)
+            frame = list(frame_shape[:2])
+            scale = entry["scale"] if entry and entry["frame"] == frame else 1
+            if widen:
+                scale = min(ROI_MAX_SCALE, scale * 2)
+            new = {"box": list(map(int, box)), "frame": frame, "scale": scale}
+            if new != entry:
+                self.entries[name] = new
+                self.save()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _match(self, image, template, matcher=match_template):
+        with self._lock:
+            self.matches += 1
+            self.pixels += image.shape[0] * image.shape[1]
+        return matcher(image, template)
+
+    def search(self, screen, name, template, threshold, full_match=match_template):
+        """Best (score, (x, y)) for `template`, trying the learned region first.
+
+        `full_match(screen, template)` is used for the full-frame fallback
+        (e.g. a pyramid matcher). The learned region is always exhaustive.
+        """
+        h, w = template.shape[:2]
+        roi = self.region(name, screen.shape)
+        if roi and (roi[2] - roi[0] < w or roi[3] - roi[1] < h):
+            roi = None # Template is bigger than when the region was learned (rescaled)
+        if roi:
+            x0, y0, x1, y1 = roi
+            score, (x, y) = self._match(screen[y0:y1, x0:x1], template)
+            if score >= threshold:
+                self._count("hits")
+                self.record(name, (x0 + x, y0 + y, w, h), screen.shape)
+                return score, (x0 + x, y0 + y)
+            self._count("misses")
+
+        self._count("full_scans")
+        score, loc = self._match(screen, template, full_match)
+        if score >= threshold:
+            # Found outside its region -> it moves around, give it more room next time
+            self.record(name, (loc[0], loc[1], w, h), screen.shape, widen=roi is not None)
+        return score, loc
+
+    def stats(self):
+        looked = self.hits + self.misses
+        return {
+            "regions": len(self.entries),
+            "roi_hits": self.hits,
+            "roi_misses": self.misses,
+            "roi_hit_rate": self.hits / looked if looked else 0.0,
+            "full_scans": self.full_scans,
+            "pixels_per_match": self.pixels / self.matches if self.matches else 0,
+        }
+
+
+class SceneResult:
+    """Scores and boxes for a set of templates on ONE frame.
+
+    Templates not asked for up front are matched on first use and cached,
+    so every template is matched at most once per frame.
+    """
+
+    def __init__(self, screen, registry, thresholds=None, rois=None, pyramid=None):
+        self.source = screen # The frame as captured, to tell whether a new one arrived
+        self.screen = to_bgr(screen)
+        self.registry = registry
+        self.thresholds = thresholds or {}
+        self.rois = rois
+        self.pyramid = pyramid or {} # name -> downscale factor for pyramid matching
+        self._small = {}             # scale -> downscaled frame, shared by all templates
+        self.scores = {} # name -> best score (None if template missing / bigger than frame)
+        self.boxes = {}  # name -> (x, y, w, h) of the best location
+
+    def match(self, name, threshold=None):
+        """Returns the best score for `name`, matching it if not done yet."""
+        if name in self.scores:
+            return self.scores[name]
+        score, box = self._compute(name, threshold)
+        self._store(name, score, box)
+        return score
+
+    def match_many(self, names, executor=None):
+        """Matches every name not done yet concurrently (on MATCHER). Returns {name: score} in `names` order."""
+        executor = executor or MATCHER
+        todo = [name for name in dict.fromkeys(names) if name not in self.scores]
+        for name in todo:
+            # Load templates and build shared downscaled frames here, not racing on the pool
+            template = self.registry.get(name)
+            if template is not None: self.full_matcher(name, template)
+        # Stored afterwards on this thread, so scores / summary() order never depends on timing
+        for name, (score, box) in zip(todo, executor.map(self._compute, todo)):
+            self._store(name, score, box)
+        return {name: self.scores[name] for name in names}
+
+    def _compute(self, name, threshold=None):
+        """(score, box) for `name` on this frame, without storing it. Safe to run on several threads."""
+        if threshold is None:
+            threshold = self.thresholds.get(name, DEFAULT_THRESHOLD)
+        template = self.registry.get(name)
+        if template is None or not fits(self.screen, template.bgr): return None, None
+        try:
+            with METRICS.span("match", template=name):
+                full = self.full_matcher(name, template)
+                if self.rois is not None:
+                    score, (x, y) = self.rois.search(self.screen, name, template.bgr, threshold, full)
+                else:
+                    score, (x, y) = full(self.screen, template.bgr)
+        except cv2.error as e:
+            print(f"OpenCV Error matching {name}: {e}")
+            return None, None
+        METRICS.set("match_score", round(score, 4), template=name)
+        return score, (x, y, template.w, template.h)
+
+    def _store(self, name, score, box):
+        if box is not None:
+            self.boxes[name] = box
+        self.scores[name] = score
+
+    def full_matcher(self, name, template):
+        """The full-frame matcher for `name`: pyramid if configured, else exhaustive."""
+        scale = self.pyramid.get(name)
+        if not scale:
+            return match_template
+        small = self._small.get(scale)
+        if small is None:
+            # Not a shared buffer: an older SceneResult may still be using its copy
+            small = self._small[scale] = downscale(self.screen, scale)
+        small_template = template.scaled(scale)
+        return lambda screen, bgr: match_pyramid(screen, bgr, scale, small, small_template)
+
+    def find(self, name, threshold=None):
+        """Returns (x, y, w, h) if `name` scored above its threshold, else None."""
+        if threshold is None:
+            threshold = self.thresholds.get(name, DEFAULT_THRESHOLD)
+        score = self.match(name, threshold)
+        if score is None or score < threshold:
+            METRICS.inc("match_misses", template=name)
+            return None
+        METRICS.inc("match_hits", template=name)
+        return self.boxes[name]
+
+    def summary(self):
+        return ", ".join(
+            f"{name}: {score:.2f}" if score is not None else f"{name}: -"
+            for name, score in self.scores.items()
+        )
+
+
+def analyze_scene(screen, names, registry, thresholds=None, rois=None, pyramid=None):
+    """Matches every template in `names` against one frame (in parallel on MATCHER). Returns a SceneResult."""
+    scene = SceneResult(screen, registry, thresholds, rois, pyramid)
+    scene.match_many(names)
+    return scene
@@ -0,0 +1,217 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- METRICS ---
+# Timing spans, counters and gauges for the hot paths, cheap enough to leave on:
+# a span is two perf_counter() calls and a dict update under a lock.
+#
+#   METRICS_FILE - append one JSON snapshot per METRICS_FLUSH seconds (JSON lines)
+#   METRICS_PORT - serve Prometheus text on http://127.0.0.1:<port>/metrics
+#
+# Both are off by default; bot.py / fleet.py start them with start_exporters().
+
+METRICS_PREFIX = "tower"
+METRICS_FLUSH = 60.0
+# Histogram bucket bounds (seconds) for spans
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class _Span:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(SPAN_BUCKETS) + 1) # Last one is +Inf
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(SPAN_BUCKETS, seconds)] += 1
+
+
+class Metrics:
+    """Thread-safe store of spans (durations), counters and gauges, keyed by name + labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started_at = time.time()
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            span = self.spans.get(key)
+            if span is None:
+                span = self.spans[key] = _Span()
+            span.add(seconds)
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator version of span()."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with self.span(name, **labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """Plain-dict copy of everything, for JSON."""
+        with self._lock:
+            spans = [
+                {"name": name, "labels": dict(labels), "count": s.count,
+                 "total_s": round(s.total, 6), "max_s": round(s.max, 6)}
+                for (name, labels), s in self.spans.items()
+            ]
+            counters = [{"name": name, "labels": dict(labels), "value": v} for (name, labels), v in self.counters.items()]
+            gauges = [{"name": name, "labels": dict(labels), "value": v} for (name, labels), v in self.gauges.items()]
+        return {"ts": round(time.time(), 3), "uptime_s": round(time.time() - self.started_at, 1),
+                "spans": spans, "counters": counters, "gauges": gauges}
+
+    def write_jsonl(self, path):
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            spans = [(name, labels, s.count, s.total, s.max, list(s.buckets)) for (name, labels), s in self.spans.items()]
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+
+        metric = f"{METRICS_PREFIX}_span_seconds"
+        if spans:
+            lines.append(f"# TYPE {metric} histogram")
+        for name, labels, count, total, _, buckets in sorted(spans):
+            base = (("span", name),) + labels
+            cumulative = 0
+            for bound, n in zip(SPAN_BUCKETS + ("+Inf",), buckets):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_labels(base + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(base)} {total:.6f}")
+            lines.append(f"{metric}_count{_labels(base)} {count}")
+        if spans:
+            lines.append(f"# TYPE {metric}_max gauge")
+        for name, labels, _, _, worst, _ in sorted(spans):
+            lines.append(f"{metric}_max{_labels((('span', name),) + labels)} {worst:.6f}")
+
+        # One TYPE line per metric family, then all its label sets
+        last = None
+        for (name, labels), value in sorted(counters):
+            if name != last:
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+                last = name
+            lines.append(f"{METRICS_PREFIX}_{name}_total{_labels(labels)} {value}")
+        last = None
+        for (name, labels), value in sorted(gauges):
+            if name != last:
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+                last = name
+            lines.append(f"{METRICS_PREFIX}_{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels: return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+METRICS = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = METRICS.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the console
+
+
+def serve(port, host="127.0.0.1"):
+    """Starts the /metrics endpoint in a daemon thread. Returns the server (server.server_port)."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _flush_loop(path, interval, stop):
+    while not stop.wait(interval):
+        try:
+            METRICS.write_jsonl(path)
+        except OSError as e:
+            print(f"Metrics write failed: {e}")
+
+
+def start_exporters(path=None, port=None, interval=METRICS_FLUSH):
+    """Starts whichever exporters are configured. Returns a stop() callable."""
+    stop = threading.Event()
+    server = None
+    if path:
+        threading.Thread(target=_flush_loop, args=(path, interval, stop), name="metrics-file", daemon=True).start()
+        print(f"Metrics: appending to {path} every {interval:g}s")
+    if port:
+        try:
+            server = serve(port)
+            print(f"Metrics: http://127.0.0.1:{server.server_port}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint not started ({e})")
+
+    def stop_exporters():
+        stop.set()
+        if server: server.shutdown()
+        if path: METRICS.write_jsonl(path) # Final snapshot
+    return stop_exporters
@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from metrics import METRICS
+
+# --- CAPTURE PIPELINE ---
+# A producer thread keeps capturing + decoding screencaps into a small ring of
+# preallocated frame buffers while the handlers match on the previous frame.
+# Handlers ask for "a frame captured after T" (usually the last tap) and get
+# the newest one that qualifies, often without waiting at all.
+#
+# adb I/O, cv2.imdecode / cvtColor and matchTemplate all release the GIL, so
+# the capture of frame N+1 really does overlap the matching of frame N.
+#
+# Ring slots are reused: the producer never writes the newest slot, nor the
+# last PIPELINE_HOLD slots handed to a consumer (they may still be matched on).
+# If no slot is free the new frame is dropped.
+
+PIPELINE_SLOTS = 4
+PIPELINE_HOLD = 2       # Frames a consumer may still be using
+PIPELINE_MIN_GAP = 0.2  # Min seconds between capture starts - lets ADB/emulator breathe
+PIPELINE_IDLE = 3.0     # Stop capturing when nobody asked for a frame for this long
+PIPELINE_MAX_ERRORS = 3 # Consecutive capture failures before the producer gives up
+
+
+class FrameRing:
+    """Fixed set of frame buffers, each stamped with a sequence number and capture time.
+
+    The buffers are allocated together once the first frame shows their size.
+    """
+
+    def __init__(self, slots=PIPELINE_SLOTS, hold=PIPELINE_HOLD):
+        self.buffers = [None] * slots
+        self.seq = [0] * slots        # 0 = empty
+        self.stamp = [0.0] * slots    # time.monotonic() when the capture started
+        self.latest = None            # Slot of the newest frame
+        self.held = deque(maxlen=hold)
+
+    def free_slot(self):
+        """Oldest slot that is neither the newest frame nor held by a consumer, or None."""
+        free = [i for i in range(len(self.buffers)) if i != self.latest and i not in self.held]
+        if not free: return None
+        return min(free, key=lambda i: self.seq[i])
+
+    def allocate(self, frame):
+        """Gives every empty or wrong-size slot a buffer like `frame` (never the newest or a held one)."""
+        for i, buffer in enumerate(self.buffers):
+            if buffer is None or (buffer.shape != frame.shape and i != self.latest and i not in self.held):
+                self.buffers[i] = np.empty_like(frame)
+
+    def hold(self, slot):
+        if not self.held or self.held[-1] != slot:
+            self.held.append(slot)
+
+
+class CapturePipeline:
+    """Background producer of decoded frames.
+
+    `capture(out)` grabs and decodes one frame, writing into the array `out` when
+    it can (None or wrong size -> return a new array). It runs on the producer thread.
+    """
+
+    def __init__(self, capture, slots=PIPELINE_SLOTS, min_gap=PIPELINE_MIN_GAP, idle=PIPELINE_IDLE, name="?"):
+        self.capture = capture
+        self.ring = FrameRing(slots)
+        self.min_gap = min_gap
+        self.idle = idle
+        self.name = name
+        self.frames = 0
+        self.handed = 0  # Distinct frames handed to consumers
+        self.dropped = 0 # Captured but never handed out (overwritten, or no free slot)
+        self.errors = 0
+        self.error = None
+        self.waits = 0
+        self.wait_time = 0.0
+        self.active_time = 0.0 # Seconds the producer was running (not idle)
+        self.last_request = time.monotonic()
+        self._handed = set() # Slots whose current frame a consumer has seen
+        self._views = {}     # slot -> (seq, frame) so one frame is always the same object
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"capture-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _wanted(self):
+        return self._stop.is_set() or time.monotonic() - self.last_request < self.idle
+
+    def _run(self):
+        try:
+            self._produce()
+        finally:
+            with self._cond:
+                self._cond.notify_all() # Waiting consumers fall back to a direct capture
+
+    def _produce(self):
+        failures = 0
+        while not self._stop.is_set():
+            with self._cond:
+                self._cond.wait_for(self._wanted) # Sleeps while no handler needs frames
+                if self._stop.is_set(): return
+                slot = self.ring.free_slot()
+            started = time.monotonic()
+            try:
+                # Outside the lock: consumers keep reading the newest frame meanwhile
+                frame = self.capture(self.ring.buffers[slot] if slot is not None else None)
+            except Exception as e:
+                frame = None
+                self.error = e
+                print(f"[{self.name}] Pipeline capture failed: {e}")
+            finished = time.monotonic()
+
+            if frame is None:
+                self.errors += 1
+                failures += 1
+                if failures >= PIPELINE_MAX_ERRORS:
+                    print(f"[{self.name}] Capture pipeline stopped after {failures} failures.")
+                    return
+                self._stop.wait(1.0)
+                self.active_time += time.monotonic() - started
+                continue
+            failures = 0
+            self.frames += 1
+            if slot is None:
+                self.dropped += 1 # Every buffer busy - nowhere to put it
+                METRICS.inc("pipeline_dropped", device=self.name)
+            else:
+                self._publish(slot, frame, started)
+            self._stop.wait(max(0.0, self.min_gap - (finished - started)))
+            self.active_time += time.monotonic() - started
+
+    def _publish(self, slot, frame, started):
+        ring = self.ring
+        with self._cond:
+            if ring.latest is not None and ring.latest not in self._handed:
+                self.dropped += 1 # Superseded before anyone looked at it
+                METRICS.inc("pipeline_dropped", device=self.name)
+            ring.buffers[slot] = frame
+            ring.allocate(frame) # First frame (or a new screen size): fill the rest of the ring
+            ring.seq[slot] = self.frames
+            ring.stamp[slot] = started
+            ring.latest = slot
+            self._handed.discard(slot)
+            self._cond.notify_all()
+
+    def frame_after(self, after, timeout):
+        """Newest frame whose capture STARTED after `after` (time.monotonic()), or None on timeout.
+
+        If the producer was idle, the frame must also have started after this request:
+        the newest one is from before the idle spell and may be any age.
+        The same frame is returned as the same array object, so callers can cache per frame.
+        """
+        ring = self.ring
+        start = time.perf_counter()
+        with self._cond:
+            now = time.monotonic()
+            if now - self.last_request >= self.idle:
+                after = max(after, now)
+            self.last_request = now
+            self._cond.notify_all() # Wake an idle producer
+            ready = self._cond.wait_for(
+                lambda: self._stop.is_set() or not self.alive
+                or (ring.latest is not None and ring.stamp[ring.latest] > after),
+                timeout)
+            waited = time.perf_counter() - start
+            self.waits += 1
+            self.wait_time += waited
+            slot = ring.latest
+            if not ready or slot is None or ring.stamp[slot] <= after:
+                frame = None
+            else:
+                ring.hold(slot)
+                if slot not in self._handed: self.handed += 1
+                self._handed.add(slot)
+                seq, frame = self._views.get(slot, (None, None))
+                if seq != ring.seq[slot]:
+                    frame = ring.buffers[slot].view() # New object per frame, same memory
+                    self._views[slot] = (ring.seq[slot], frame)
+        METRICS.observe("pipeline_wait", waited, device=self.name)
+        return frame
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "handed": self.handed,
+            "fps": round(self.frames / self.active_time, 1) if self.active_time else 0.0,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "avg_wait_ms": round(self.wait_time / self.waits * 1000, 1) if self.waits else 0.0,
+        }
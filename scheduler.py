@@ -0,0 +1,171 @@
+import heapq
+import random
+import threading
+import time
+
+# --- TASK SCHEDULER ---
+# Every routine (gems, upgrades, quests, X sweep, game over) is a Task with its
+# own deadline. The scheduler sleeps exactly until the earliest one instead of
+# waking on a fixed loop, and records how late each task actually started.
+
+
+class Task:
+    """A repeating job.
+
+    interval  - seconds between runs, or (min, max) to pick randomly each time
+    jitter    - +/- seconds of random drift added to every deadline
+    priority  - lower runs first when several tasks are due together
+    gap_group - tasks sharing a group never run within `gap` seconds of each other
+    allowed   - optional callable; if it returns False the run is skipped and
+                retried after `retry` seconds (does NOT count for the gap)
+
+    `action()` may return a number of seconds to override the next interval.
+    """
+
+    def __init__(self, name, action, interval, jitter=0, priority=0,
+                 gap_group=None, gap=0, allowed=None, retry=None):
+        self.name = name
+        self.action = action
+        self.interval = interval
+        self.jitter = jitter
+        self.priority = priority
+        self.gap_group = gap_group
+        self.gap = gap
+        self.allowed = allowed
+        self.retry = retry if retry is not None else self.next_interval()
+        self.deadline = 0.0
+        self.entry = 0 # Heap entry currently in force (older ones are stale)
+        # Report
+        self.runs = 0
+        self.skips = 0
+        self.deferrals = 0
+        self.lateness = [] # Seconds between deadline and actual start
+        self.durations = [] # Seconds each run took
+
+    def next_interval(self):
+        if isinstance(self.interval, (tuple, list)):
+            base = random.uniform(*self.interval)
+        else:
+            base = self.interval
+        if self.jitter:
+            base += random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+
+class Scheduler:
+    """Heap of task deadlines. Runs due tasks in priority order, sleeps until the next one."""
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._stop = threading.Event()
+        self.tasks = {}
+        self._heap = []
+        self._seq = 0
+        self._group_last = {} # gap_group -> when a task of that group last ran
+        self.before_run = None # Optional callback before each batch of due tasks
+        self.after_run = None  # Optional callback(names_that_ran) after each batch
+
+    def add(self, task, delay=0.0):
+        self.tasks[task.name] = task
+        self._push(task, self.clock() + delay)
+        return task
+
+    def _push(self, task, deadline):
+        task.deadline = deadline
+        self._seq += 1
+        task.entry = self._seq
+        heapq.heappush(self._heap, (deadline, task.priority, self._seq, task))
+
+    def reschedule(self, name, delay):
+        """Moves a task's next run to `delay` seconds from now."""
+        # The old heap entry is left in place and skipped as stale when popped
+        self._push(self.tasks[name], self.clock() + delay)
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0][2] != self._heap[0][3].entry:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now):
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[3])
+            self._drop_stale()
+        return due
+
+    def run_due(self):
+        """Runs every task whose deadline has passed. Returns the names that ran."""
+        now = self.clock()
+        ran = []
+        for task in self._pop_due(now):
+            now = self.clock()
+
+            if task.gap_group:
+                last = self._group_last.get(task.gap_group)
+                if last is not None and now - last < task.gap:
+                    # Too soon after another task of the same group - wait for the gap
+                    task.deferrals += 1
+                    self._push(task, last + task.gap)
+                    continue
+
+            if task.allowed is not None and not task.allowed():
+                task.skips += 1
+                self._push(task, now + task.retry)
+                continue
+
+            task.lateness.append(now - task.deadline)
+            task.runs += 1
+            try:
+                override = task.action()
+            except Exception as e:
+                print(f"Error in {task.name}: {e}")
+                override = None
+            task.durations.append(self.clock() - now)
+            if task.gap_group:
+                self._group_last[task.gap_group] = now
+            delay = override if isinstance(override, (int, float)) else task.next_interval()
+            # Deadlines count from the start of the run, like the old loop's timers
+            self._push(task, now + delay)
+            ran.append(task.name)
+        return ran
+
+    def next_deadline(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, seconds):
+        """Sleep that returns early on stop(). Use as `sleep` for worker threads
+        (plain time.sleep stays the default: it's the one Ctrl+C can interrupt on Windows)."""
+        self._stop.wait(seconds)
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run_forever(self):
+        while not self.stopped:
+            deadline = self.next_deadline()
+            if deadline is None: return
+            wait = deadline - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+                if self.stopped: return
+            if self.before_run: self.before_run()
+            ran = self.run_due()
+            if ran and self.after_run: self.after_run(ran)
+
+    def report(self):
+        lines = ["Task         runs  skips  deferred  late avg   late max"]
+        for task in sorted(self.tasks.values(), key=lambda t: t.priority):
+            late = task.lateness
+            avg = sum(late) / len(late) if late else 0.0
+            worst = max(late) if late else 0.0
+            lines.append(
+                f"{task.name:<12} {task.runs:>4}  {task.skips:>5}  {task.deferrals:>8}  "
+                f"{avg * 1000:>6.0f} ms  {worst * 1000:>6.0f} ms"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,163 @@
+import struct
+import time
+import cv2
+import numpy as np
+
+# --- SCREEN CAPTURE DECODING ---
+# "png": `screencap -p`, device compresses, we imdecode. Small payload, slow.
+# "raw": `screencap` (no -p), header + RGBA pixels. Big payload, no codec work.
+#
+# Raw header versions (little-endian uint32):
+#   v1 (12 bytes): width, height, format
+#   v2 (16 bytes): width, height, format, colorspace   (Android 12+)
+
+# PixelFormat -> (bytes per pixel, cvtColor code to BGR)
+RAW_FORMATS = {
+    1: (4, cv2.COLOR_RGBA2BGR), # RGBA_8888
+    2: (4, cv2.COLOR_RGBA2BGR), # RGBX_8888
+    3: (3, cv2.COLOR_RGB2BGR),  # RGB_888
+    5: (4, cv2.COLOR_BGRA2BGR), # BGRA_8888
+}
+HEADER_SIZES = (16, 12) # Try the newer header first
+
+
+class RawFormatError(ValueError):
+    """Payload doesn't look like a raw screencap we know how to read."""
+
+
+def parse_raw_header(data):
+    """Returns (width, height, format, header_size) for a raw screencap payload."""
+    if len(data) < 12:
+        raise RawFormatError(f"Payload too short ({len(data)} bytes)")
+    width, height, fmt = struct.unpack_from("<III", data, 0)
+    if fmt not in RAW_FORMATS:
+        raise RawFormatError(f"Unsupported pixel format {fmt}")
+    bpp = RAW_FORMATS[fmt][0]
+    pixels = width * height * bpp
+    # Header version is whatever makes the sizes add up
+    for header_size in HEADER_SIZES:
+        if len(data) == header_size + pixels:
+            return width, height, fmt, header_size
+    raise RawFormatError(f"Size mismatch: {len(data)} bytes for {width}x{height} fmt {fmt}")
+
+
+def decode_raw(data, out=None):
+    """Views the raw payload as a (h, w, c) array without copying, then converts to BGR once.
+
+    If `out` is a BGR array of the right size the result is written into it (no allocation).
+    """
+    width, height, fmt, header_size = parse_raw_header(data)
+    bpp, code = RAW_FORMATS[fmt]
+    pixels = np.frombuffer(data, np.uint8, count=width * height * bpp, offset=header_size)
+    if out is not None and out.shape == (height, width, 3):
+        return cv2.cvtColor(pixels.reshape(height, width, bpp), code, dst=out)
+    return cv2.cvtColor(pixels.reshape(height, width, bpp), code)
+
+
+def decode_png(data, out=None):
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is not None and out is not None and out.shape == frame.shape:
+        np.copyto(out, frame) # imdecode can't write in place - keep the caller's buffer anyway
+        return out
+    return frame
+
+
+class FrameBuffers:
+    """A few frame arrays decoded into round-robin, plus the transfer buffer, reused every capture.
+
+    keep() returns a new array object (a view) per frame, so `frame is previous`
+    checks still see a new frame. A frame's pixels are overwritten `count`
+    captures later - don't hold on to one longer than that.
+    """
+
+    def __init__(self, count=3):
+        self.frames = [None] * count
+        self.next = 0
+        self.transfer = bytearray() # For transport.exec_out(..., buffer)
+
+    def take(self):
+        """The array the next frame should be decoded into (None until the first frame)."""
+        return self.frames[self.next]
+
+    def keep(self, frame):
+        """Stores the decoded frame in the current slot and returns a fresh view of it."""
+        self.frames[self.next] = frame
+        self.next = (self.next + 1) % len(self.frames)
+        return frame.view()
+
+
+def capture_command(mode):
+    return "screencap -p" if mode == "png" else "screencap"
+
+
+class CaptureStats:
+    """Per-mode byte counts and timings, for comparing raw vs png."""
+
+    def __init__(self):
+        self.modes = {}
+        self.last = None
+
+    def record(self, mode, nbytes, transfer_s, decode_s):
+        self.last = {"mode": mode, "bytes": nbytes, "transfer_ms": transfer_s * 1000, "decode_ms": decode_s * 1000}
+        m = self.modes.setdefault(mode, {"captures": 0, "bytes": 0, "transfer_s": 0.0, "decode_s": 0.0})
+        m["captures"] += 1
+        m["bytes"] += nbytes
+        m["transfer_s"] += transfer_s
+        m["decode_s"] += decode_s
+
+    def summary(self):
+        lines = []
+        for mode, m in self.modes.items():
+            n = m["captures"]
+            lines.append(
+                f"{mode}: {n} captures, avg {m['bytes'] / n / 1024:.0f} KB, "
+                f"transfer {m['transfer_s'] / n * 1000:.1f} ms, decode {m['decode_s'] / n * 1000:.1f} ms"
+            )
+        return "\n".join(lines) if lines else "No captures yet."
+
+
+def timed_decode(data, mode, out=None):
+    """Decodes a payload in the given mode (into `out` if it fits). Returns (frame, seconds)."""
+    start = time.perf_counter()
+    frame = decode_raw(data, out) if mode == "raw" else decode_png(data, out)
+    return frame, time.perf_counter() - start
+
+
+def main():
+    """Raw -> PNG fallback drill: a device that rejects plain `screencap`, through the bot's capture paths."""
+    import sys
+    import bot
+    from fake_adb import FakeAdbServer, FakeDevice
+
+    class NoRawDevice(FakeDevice):
+        def run(self, command):
+            self.commands.append(command)
+            if command.split() == ["screencap"]:
+                return b"error: no display\n", 0 # Short reply, then a PNG bigger than the buffer
+            return self.screencap, 0
+
+    frame = np.random.default_rng(0).integers(0, 256, (480, 270, 3), np.uint8)
+    device = NoRawDevice("emulator-5554", cv2.imencode(".png", frame)[1].tobytes())
+    server = FakeAdbServer([device]).start()
+    session = bot.SESSION
+    session.adb_port = server.port
+    session.serial = device.serial
+    ok = True
+    try:
+        for source in ("screencap", "pipeline"):
+            session.capture_mode = "raw"
+            session.frame_source = source
+            session.frames.invalidate()
+            screen = bot.get_screen()
+            good = screen is not None and session.capture_mode == "png" and np.array_equal(screen, frame)
+            print(f"{source}: {'OK' if good else 'FAIL'}")
+            ok = ok and good
+            bot.stop_frame_sources(session)
+    finally:
+        bot.drop_connection()
+        server.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
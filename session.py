@@ -0,0 +1,93 @@
+import threading
+import time
+
+from adb_transport import ADB_PORT
+from frames import FrameCache
+from inputs import InputQueue
+from matching import ROI_FILE, RoiIndex
+from scheduler import Scheduler
+from screencap import CaptureStats, FrameBuffers
+
+# --- DEVICE SESSIONS ---
+# Everything that belongs to ONE emulator lives on a DeviceSession.
+# bot.py always works on current_session(): the single-device bot has one
+# default session, fleet mode gives each device thread its own.
+
+
+class DeviceSession:
+    """Connection, caches, timers and round state for one device."""
+
+    def __init__(self, serial=None, pinned=False, roi_file=ROI_FILE, adb_port=ADB_PORT,
+                 transport_mode="auto", capture_mode="raw", frame_source="screencap"):
+        self.serial = serial
+        self.pinned_serial = serial if pinned else None # Fleet: only ever reconnect to this one
+        self.adb_port = adb_port
+        self.transport_mode = transport_mode
+        self.transport = None
+        self.capture_mode = capture_mode
+        self.capture_stats = CaptureStats()
+        self.decode_buffers = FrameBuffers()
+        self.frame_source = frame_source
+        self.stream = None # StreamFrameSource while frame_source == "stream" and it is running
+        self.pipeline = None # CapturePipeline while frame_source == "pipeline"
+        self.last_input = 0.0 # time.monotonic() of the last tap/swipe
+        self.inputs = InputQueue()
+        self.templates = None # Calibrated (rescaled) registry for this device; None = as cropped
+        self.scale = None     # Template scale found by calibration
+        self.calibration_tries = 0     # Failed detections (no anchor) for calibrated_frame
+        self.calibration_next = None   # time.monotonic() before which no detection is tried
+        self.calibrated_frame = None   # (h, w) the calibration state is for
+        self.frames = FrameCache()
+        self.rois = RoiIndex(roi_file)
+        self.scene = None # SceneResult for the latest frame, shared by every check on it
+        self.cadence = None # Cadence when ADAPTIVE_CADENCE is on
+        self.round_start_time = time.time()
+        self.scheduler = Scheduler()
+        self.started_at = time.time()
+
+    @property
+    def name(self):
+        return self.pinned_serial or self.serial or "?"
+
+    def summary(self):
+        """One line of throughput / latency numbers for this device."""
+        tasks = self.scheduler.tasks.values()
+        runs = sum(t.runs for t in tasks)
+        durations = sorted(d for t in tasks for d in t.durations)
+        lateness = [l for t in tasks for l in t.lateness]
+        minutes = max(1e-9, (time.time() - self.started_at) / 60)
+        captures = sum(m["captures"] for m in self.capture_stats.modes.values())
+        capture_s = sum(m["transfer_s"] + m["decode_s"] for m in self.capture_stats.modes.values())
+        p50 = durations[len(durations) // 2] if durations else 0.0
+        p95 = durations[int(len(durations) * 0.95)] if durations else 0.0
+        return (
+            f"{self.name:<20} {runs:>5} runs ({runs / minutes:5.1f}/min)  "
+            f"task p50 {p50 * 1000:6.0f} ms  p95 {p95 * 1000:6.0f} ms  "
+            f"late avg {sum(lateness) / len(lateness) * 1000 if lateness else 0:5.0f} ms  "
+            f"{captures} captures (avg {capture_s / captures * 1000 if captures else 0:.0f} ms)"
+        )
+
+
+_local = threading.local()
+_default = None
+
+
+def set_default_session(session):
+    """The session used by threads that haven't called use_session()."""
+    global _default
+    _default = session
+
+
+def use_session(session):
+    """Binds `session` to the calling thread."""
+    _local.session = session
+
+
+def current_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _default
+        if session is None:
+            session = DeviceSession()
+            set_default_session(session)
+    return session
@@ -0,0 +1,228 @@
+import subprocess
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+# --- STREAMING FRAME SOURCE ---
+# Keeps ONE `screenrecord ... -` running and decodes it in a background thread,
+# instead of paying a full screencap per frame. Consumers just read the newest
+# decoded frame. screencap stays the fallback whenever the stream isn't alive.
+#
+# "h264": decoded by an ffmpeg subprocess (ffmpeg on PATH, or ffmpeg.exe in platform-tools)
+# "raw":  `--output-format=raw-frames`, back-to-back RGB888 frames, no decoder needed
+#         but ~7 MB per 1080p frame over the adb link.
+#
+# Check the decoder on a local video file:  python stream.py <video file>
+
+FFMPEG = "ffmpeg"
+# screenrecord only sends a frame when the screen changes, so nothing may follow the
+# last frame of a transition for a long time. Without these ffmpeg holds frames back
+# (input probing, packet buffering, frame-threaded decoding delays output by one
+# frame per thread) and latest() would show the screen mid-transition.
+FFMPEG_LOW_DELAY = ["-fflags", "nobuffer", "-flags", "low_delay", "-threads", "1"]
+FFMPEG_NO_PROBE = ["-probesize", "32", "-analyzeduration", "0"] # Only with a known input format
+STREAM_FORMAT = "h264"
+STREAM_BIT_RATE = 8000000
+STREAM_RESTART_DELAY = 1.0 # Seconds before restarting a stream that ended or failed
+
+
+def decode_video(stream, width, height, input_format="h264"):
+    """Yields BGR frames from an encoded video byte stream, decoded by an ffmpeg subprocess.
+
+    `input_format=None` lets ffmpeg probe the container (handy for test files).
+    Output is scaled to width x height so every frame has a known size.
+    Decoding is low-delay: each frame comes out as soon as its data went in.
+    """
+    cmd = [FFMPEG, "-loglevel", "error"] + FFMPEG_LOW_DELAY
+    if input_format:
+        cmd += FFMPEG_NO_PROBE + ["-f", input_format]
+    cmd += ["-i", "pipe:0", "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "pipe:1"]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def feed():
+        # Device -> ffmpeg stdin, on its own thread so decoding never waits on the socket
+        try:
+            while True:
+                chunk = stream.read(65536)
+                if not chunk: break
+                proc.stdin.write(chunk)
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=feed, name="frame-stream-feed", daemon=True).start()
+    size = width * height * 3
+    try:
+        while True:
+            buf = _read_exact(proc.stdout, size)
+            if buf is None: return
+            yield np.frombuffer(buf, np.uint8).reshape(height, width, 3)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def _read_exact(stream, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        chunk = stream.read(n - got)
+        if not chunk: return None
+        view[got:got + len(chunk)] = chunk
+        got += len(chunk)
+    return buf
+
+
+def decode_raw_frames(stream, width, height):
+    """Yields BGR frames from a screenrecord raw-frames (RGB888) stream."""
+    size = width * height * 3
+    while True:
+        buf = _read_exact(stream, size)
+        if buf is None: return
+        rgb = np.frombuffer(buf, np.uint8).reshape(height, width, 3)
+        yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+class StreamFrameSource:
+    """Background screenrecord reader that always holds the latest decoded frame.
+
+    `open_stream(command)` must return an object with read(n) / close(),
+    e.g. transport.open_stream, or a function opening a local file for testing.
+    """
+
+    def __init__(self, open_stream, width, height, fmt=STREAM_FORMAT, restart=True, input_format="h264"):
+        self.open_stream = open_stream
+        self.width = width
+        self.height = height
+        self.fmt = fmt
+        self.input_format = input_format # What ffmpeg should expect (None = probe)
+        self.restart = restart # screenrecord stops by itself after ~3 minutes
+        self.frame = None
+        self.timestamp = 0.0   # time.monotonic() when self.frame was decoded
+        self.frames = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.error = None
+        self._new_frame = threading.Condition()
+        self._stop = threading.Event()
+        self._stream = None
+        self._thread = None
+
+    @property
+    def command(self):
+        output = "raw-frames" if self.fmt == "raw" else "h264"
+        return (f"screenrecord --output-format={output} --size {self.width}x{self.height} "
+                f"--bit-rate {STREAM_BIT_RATE} -")
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive() and self.frame is not None
+
+    def start(self):
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="frame-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._stream is not None:
+            self._stream.close() # Unblocks the reader
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._stream = self.open_stream(self.command)
+                if self.fmt == "raw":
+                    frames = decode_raw_frames(self._stream, self.width, self.height)
+                else:
+                    frames = decode_video(self._stream, self.width, self.height, self.input_format)
+                for frame in frames:
+                    self._publish(frame)
+                    if self._stop.is_set(): break
+            except Exception as e:
+                self.error = e
+                print(f"Frame stream error: {e}")
+            finally:
+                if self._stream is not None:
+                    self._stream.close()
+                    self._stream = None
+            if self.frames == 0:
+                # Never produced a frame (error, or screenrecord quit on an unsupported
+                # size / no encoder) - don't hammer the device, stay on screencap
+                if not self._stop.is_set(): print("Frame stream produced no frames - staying on screencap.")
+                return
+            if not self.restart: return
+            self.restarts += 1
+            self._stop.wait(STREAM_RESTART_DELAY)
+
+    def _publish(self, frame):
+        with self._new_frame:
+            self.frame = frame
+            self.timestamp = time.monotonic()
+            self.frames += 1
+            self._new_frame.notify_all()
+
+    def latest(self):
+        """Returns (frame, timestamp) of the newest frame, or (None, 0.0)."""
+        return self.frame, self.timestamp
+
+    def wait_newer(self, after, timeout):
+        """Newest frame decoded after `after` (monotonic), waiting up to `timeout`.
+
+        If nothing newer arrives the latest frame is returned: screenrecord only
+        emits frames when the screen changes, so no new frame means no change.
+        """
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self.timestamp > after, timeout)
+            return self.frame
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "format": self.fmt,
+            "frames": self.frames,
+            "fps": round(self.frames / elapsed, 1) if elapsed else 0.0,
+            "restarts": self.restarts,
+            "frame_age_s": round(time.monotonic() - self.timestamp, 2) if self.frame is not None else None,
+        }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python stream.py <video file>")
+        sys.exit(2)
+    path = sys.argv[1]
+    probe = cv2.VideoCapture(path)
+    width, height = int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    expected = int(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+    probe.release()
+    if not width or not height:
+        print(f"Could not read the frame size of {path}")
+        sys.exit(1)
+    # Same reader/decoder path as the live stream, just fed from a file
+    source = StreamFrameSource(lambda command: open(path, "rb"), width, height,
+                               restart=False, input_format=None).start()
+    source._thread.join()
+    print(f"Decoded {source.frames} of {expected or '?'} frames from {path}: {source.stats()}")
+    if source.frame is not None:
+        print(f"Last frame: {source.frame.shape[1]}x{source.frame.shape[0]}")
+    if expected and source.frames < expected:
+        # Frames stuck in the decoder: on a live stream the final screen would never show
+        print(f"Missing the last {expected - source.frames} frame(s).")
+        sys.exit(1)
+    sys.exit(0 if source.frames else 1)
+
+
+if __name__ == "__main__":
+    main()
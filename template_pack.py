@@ -0,0 +1,189 @@
+import json
+import os
+import struct
+import sys
+import tempfile
+import cv2
+import numpy as np
+
+# --- TEMPLATE PACK ---
+# The whole "The Tower Buttons" folder compiled into ONE binary file: a JSON
+# index followed by 64-byte aligned, already converted arrays (BGR, grayscale and
+# the downscaled pyramid variants). Bots open it with np.memmap, so startup
+# decodes nothing and every bot process on the machine shares the same pages.
+#
+# The index records each PNG's mtime and size; if anything in the folder
+# changes, the pack is rebuilt on the next start. Each process builds into its own
+# temp file and swaps it in with os.replace, so bots starting together never
+# write the same file or map a half-written one.
+#
+# No threshold or default ROI per template: the folder has no source for them.
+# Thresholds are chosen per call site (bot.py), and ROIs are learned per device
+# (roi_index.json) - a default baked into a shared pack would be wrong for the
+# next emulator resolution.
+#
+# Build by hand:  python template_pack.py [images folder] [pack file]
+#
+# Layout: b"TWRPACK1" | uint64 index length | index JSON | pad | arrays...
+
+PACK_FILE = "templates.pack"
+PACK_MAGIC = b"TWRPACK1"
+PACK_ALIGN = 64
+PACK_VERSION = 1
+
+
+class PackError(ValueError):
+    """The file is not a template pack this version can read."""
+
+
+def _align(n):
+    return (n + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+
+
+def source_stamps(images_dir):
+    """{png name: [mtime, size]} for the template folder."""
+    stamps = {}
+    if not os.path.isdir(images_dir): return stamps
+    for name in sorted(os.listdir(images_dir)):
+        if not name.lower().endswith(".png"): continue
+        st = os.stat(os.path.join(images_dir, name))
+        stamps[name] = [st.st_mtime, st.st_size]
+    return stamps
+
+
+def build_pack(images_dir, pack_path=PACK_FILE, scales=()):
+    """Decodes every PNG once and writes the pack. Returns the number of templates packed."""
+    from templates import Template # templates.py imports this module
+    stamps = source_stamps(images_dir)
+    entries = {}
+    arrays = []
+    offset = 0
+    for name, (mtime, _) in stamps.items():
+        image = cv2.imread(os.path.join(images_dir, name), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            print(f"Skipping unreadable template {name}")
+            continue
+        template = Template(name, os.path.join(images_dir, name), mtime, image)
+        variants = {"bgr": template.bgr, "gray": template.gray}
+        for scale in scales:
+            variants[f"scaled:{scale}"] = template.scaled(scale)
+        layout = {}
+        for key, array in variants.items():
+            array = np.ascontiguousarray(array, dtype=np.uint8)
+            offset = _align(offset)
+            layout[key] = {"offset": offset, "shape": list(array.shape)}
+            arrays.append((offset, array))
+            offset += array.nbytes
+        entries[name] = {"w": template.w, "h": template.h, "mtime": mtime, "variants": layout}
+
+    index = json.dumps({
+        "version": PACK_VERSION,
+        "sources": stamps,
+        "scales": sorted(scales),
+        "templates": entries,
+    }).encode()
+    data_start = _align(len(PACK_MAGIC) + 8 + len(index))
+
+    # Per-process temp file next to the pack: bots rebuilding at once don't share it
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(pack_path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(pack_path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PACK_MAGIC + struct.pack("<Q", len(index)) + index)
+            for array_offset, array in arrays:
+                f.seek(data_start + array_offset)
+                f.write(array.tobytes())
+            f.truncate(data_start + _align(offset))
+        # Fails on Windows while another bot has the old pack mapped - caller falls back
+        os.replace(tmp, pack_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return len(entries)
+
+
+def read_index(pack_path):
+    """Returns (index dict, byte offset of the array data)."""
+    with open(pack_path, "rb") as f:
+        head = f.read(len(PACK_MAGIC) + 8)
+        if len(head) < len(PACK_MAGIC) + 8 or head[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise PackError(f"{pack_path} is not a template pack")
+        (length,) = struct.unpack("<Q", head[len(PACK_MAGIC):])
+        index = json.loads(f.read(length))
+    if index.get("version") != PACK_VERSION:
+        raise PackError(f"{pack_path}: pack version {index.get('version')}, expected {PACK_VERSION}")
+    return index, _align(len(PACK_MAGIC) + 8 + length)
+
+
+class TemplatePack:
+    """A memory-mapped pack. array(name, variant) returns read-only views, no copies."""
+
+    def __init__(self, pack_path):
+        self.path = pack_path
+        self.index, data_start = read_index(pack_path)
+        self.templates = self.index["templates"]
+        size = os.path.getsize(pack_path) - data_start
+        needed = max((layout["offset"] + int(np.prod(layout["shape"]))
+                      for entry in self.templates.values() for layout in entry["variants"].values()), default=0)
+        if size < needed:
+            raise PackError(f"{pack_path} is truncated ({size} of {needed} data bytes)")
+        self._data = np.memmap(pack_path, np.uint8, "r", offset=data_start, shape=(size,)) if size else None
+
+    def is_current(self, images_dir, scales=()):
+        """True if built from exactly the PNGs now in `images_dir`, with every scale asked for."""
+        return (self.index["sources"] == source_stamps(images_dir)
+                and set(scales) <= set(self.index["scales"]))
+
+    def array(self, name, variant):
+        layout = self.templates[name]["variants"].get(variant)
+        if layout is None: return None
+        shape = layout["shape"]
+        start = layout["offset"]
+        return self._data[start:start + int(np.prod(shape))].reshape(shape)
+
+    def scaled(self, name):
+        """{scale: array} of the pyramid variants packed for `name`."""
+        variants = self.templates[name]["variants"]
+        return {float(key.split(":", 1)[1]): self.array(name, key) for key in variants if key.startswith("scaled:")}
+
+
+def open_pack(images_dir, pack_path=PACK_FILE, scales=()):
+    """Opens the pack, rebuilding it first if the PNGs changed. Returns None if that fails."""
+    scales = tuple(scales)
+    pack = None
+    try:
+        pack = TemplatePack(pack_path)
+    except (OSError, ValueError) as e:
+        if os.path.exists(pack_path):
+            print(f"Template pack unreadable ({e}), rebuilding.")
+    if pack is not None and pack.is_current(images_dir, scales):
+        return pack
+
+    pack = None # Drop the old mapping before replacing the file
+    try:
+        count = build_pack(images_dir, pack_path, scales)
+        print(f"Template pack built: {count} templates -> {pack_path}")
+        return TemplatePack(pack_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not build template pack ({e}). Decoding PNGs instead.")
+        return None
+
+
+def main():
+    images_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    pack_path = sys.argv[2] if len(sys.argv) > 2 else PACK_FILE
+    scales = ()
+    if images_dir is None:
+        from bot import IMAGES_DIR, PYRAMID_SCALES # Changes into the bot folder
+        images_dir = IMAGES_DIR
+        scales = sorted(set(PYRAMID_SCALES.values()))
+    count = build_pack(images_dir, pack_path, scales)
+    print(f"Packed {count} templates from {images_dir} into {os.path.abspath(pack_path)} "
+          f"({os.path.getsize(pack_path) // 1024} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import time
+import cv2
+
+from template_pack import open_pack
+
+# --- TEMPLATE REGISTRY ---
+# Decodes every button PNG once and keeps it in RAM.
+# A file is only decoded again when its mtime changes on disk.
+# With a pack_path, preload() maps the compiled template pack (template_pack.py)
+# instead of decoding anything.
+
+IMAGES_DIR = "The Tower Buttons"
+RECHECK_INTERVAL = 5.0 # Seconds between mtime checks for the same file
+
+
+class Template:
+    """A decoded button image plus the precomputed variants used for matching."""
+
+    def __init__(self, name, path, mtime, image):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        # Channel-normalized: matching always runs on 3-channel BGR
+        if image.ndim == 2:
+            self.bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            self.bgr = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        else:
+            self.bgr = image
+        self.gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        self.h, self.w = self.bgr.shape[:2]
+        self.checked_at = time.time()
+        self._scaled = {}
+
+    @classmethod
+    def from_pack(cls, name, path, mtime, bgr, gray, scaled):
+        """A template backed by memory-mapped pack arrays (nothing decoded or copied)."""
+        template = cls.__new__(cls)
+        template.name = name
+        template.path = path
+        template.mtime = mtime
+        template.bgr = bgr
+        template.gray = gray
+        template.h, template.w = bgr.shape[:2]
+        template.checked_at = time.time()
+        template._scaled = dict(scaled)
+        return template
+
+    def scaled(self, scale):
+        """Downscaled BGR copy for pyramid matching (built once per scale)."""
+        small = self._scaled.get(scale)
+        if small is None:
+            small = cv2.resize(self.bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self._scaled[scale] = small
+        return small
+
+    @property
+    def size(self):
+        return (self.w, self.h)
+
+
+class TemplateRegistry:
+    """Loads templates once, serves them from memory, reloads on mtime change."""
+
+    def __init__(self, images_dir=IMAGES_DIR, recheck_interval=RECHECK_INTERVAL, pack_path=None, pack_scales=()):
+        self.images_dir = images_dir
+        self.recheck_interval = recheck_interval
+        self.pack_path = pack_path
+        self.pack_scales = pack_scales # Pyramid scales to precompute in the pack
+        self.pack = None
+        self._templates = {}
+        self.packed = 0   # Templates served from the pack
+        self.loads = 0    # PNG decodes (initial + reloads)
+        self.reloads = 0  # Decodes caused by an mtime change
+        self.hits = 0     # Lookups served from memory
+        self.misses = 0   # Lookups for files that don't exist / can't decode
+
+    def names(self):
+        if not os.path.isdir(self.images_dir): return []
+        return sorted(f for f in os.listdir(self.images_dir) if f.lower().endswith(".png"))
+
+    def preload(self):
+        """Loads every template in the folder (from the pack if configured). Returns how many were loaded."""
+        if self.pack_path:
+            self._load_pack()
+        for name in self.names():
+            if name not in self._templates:
+                self._load(name)
+        return len(self._templates)
+
+    def _load_pack(self):
+        self.pack = open_pack(self.images_dir, self.pack_path, self.pack_scales)
+        if self.pack is None: return
+        for name, entry in self.pack.templates.items():
+            self._templates[name] = Template.from_pack(
+                name, os.path.join(self.images_dir, name), entry["mtime"],
+                self.pack.array(name, "bgr"), self.pack.array(name, "gray"), self.pack.scaled(name),
+            )
+        self.packed = len(self.pack.templates)
+
+    def _load(self, name):
+        path = os.path.join(self.images_dir, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self._templates.pop(name, None)
+            return None
+
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            self._templates.pop(name, None)
+            return None
+
+        previous = self._templates.get(name)
+        template = Template(name, path, mtime, image)
+        self._templates[name] = template
+        self.loads += 1
+        if previous is not None:
+            self.reloads += 1
+            print(f"Template changed on disk, reloaded: {name}")
+        return template
+
+    def get(self, name):
+        """Returns the Template for `name`, or None if it doesn't exist."""
+        template = self._templates.get(name)
+        if template is None:
+            template = self._load(name)
+            if template is None:
+                self.misses += 1
+            return template
+
+        now = time.time()
+        if now - template.checked_at >= self.recheck_interval:
+            template.checked_at = now
+            try:
+                mtime = os.path.getmtime(template.path)
+            except OSError:
+                # File was deleted - forget it
+                self._templates.pop(name, None)
+                self.misses += 1
+                return None
+            if mtime != template.mtime:
+                template = self._load(name)
+                if template is None:
+                    self.misses += 1
+                return template
+
+        self.hits += 1
+        return template
+
+    def stats(self):
+        return {
+            "templates": len(self._templates),
+            "packed": self.packed,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,256 @@
+import sys
+import threading
+import time
+
+from adb_transport import ADB_HOST, ADB_PORT, AdbConnection, AdbError, list_devices
+from metrics import METRICS
+
+# --- DEVICE TRACKER ---
+# One long-lived `host:track-devices` connection per adb server. The server
+# pushes the full device list every time any device changes state, so the bot
+# knows the moment an emulator comes back - no `adb devices` polling loop.
+# Code that lost its device waits on wait_ready() (an event with a timeout);
+# if the tracking connection itself is down, it polls with exponential backoff.
+
+TRACK_BACKOFF_MIN = 0.5 # Seconds before re-opening a dropped tracking connection...
+TRACK_BACKOFF_MAX = 10.0 # ...doubling up to this
+POLL_BACKOFF_MIN = 0.5  # Fallback `adb devices` polling when tracking is down
+POLL_BACKOFF_MAX = 8.0
+
+
+class DeviceState:
+    """Live state of one serial plus its outage history."""
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.state = "offline"
+        self.since = time.monotonic()  # When it entered the current state
+        self.disconnects = 0
+        self.reconnects = 0
+        self.downtime = 0.0            # Total seconds not "device" after having been ready
+        self.last_outage = None        # Seconds of the latest completed outage
+        self.seen_ready = False
+
+    @property
+    def ready(self):
+        return self.state == "device"
+
+    def update(self, state, now):
+        """Applies a new state. Returns "connected" (first time), "reconnected", "disconnected" or None."""
+        if state == self.state: return None
+        was_ready = self.ready
+        outage = now - self.since
+        self.state = state
+        self.since = now
+        if self.ready:
+            if not self.seen_ready:
+                self.seen_ready = True
+                return "connected"
+            self.reconnects += 1
+            self.downtime += outage
+            self.last_outage = outage
+            return "reconnected"
+        if was_ready:
+            self.disconnects += 1
+            return "disconnected"
+        return None
+
+    def stats(self):
+        down_now = time.monotonic() - self.since if self.seen_ready and not self.ready else 0.0
+        return {
+            "state": self.state,
+            "disconnects": self.disconnects,
+            "reconnects": self.reconnects,
+            "downtime_s": round(self.downtime + down_now, 1),
+            "last_outage_s": round(self.last_outage, 1) if self.last_outage is not None else None,
+        }
+
+
+def parse_device_list(text):
+    """{serial: state} from a host:devices / host:track-devices message."""
+    devices = {}
+    for line in text.strip().split("\n"):
+        parts = line.split()
+        if len(parts) >= 2:
+            devices[parts[0]] = parts[1]
+    return devices
+
+
+class DeviceTracker:
+    """Follows `host:track-devices` in a background thread and keeps a DeviceState per serial."""
+
+    def __init__(self, host=ADB_HOST, port=ADB_PORT):
+        self.host = host
+        self.port = port
+        self.devices = {}     # serial -> DeviceState
+        self.tracking = False # True while the tracking connection is up and has sent a list
+        self.connects = 0     # Times the tracking connection was (re)opened
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._conn = None
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"adb-tracker-{self.port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        conn = self._conn
+        if conn is not None: conn.close() # Unblocks the reader
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        backoff = TRACK_BACKOFF_MIN
+        while not self._stop.is_set():
+            try:
+                self._conn = AdbConnection(self.host, self.port)
+                self._conn.request("host:track-devices")
+                self._conn.sock.settimeout(None) # Quiet for as long as nothing changes
+                self.connects += 1
+                while not self._stop.is_set():
+                    self.apply(parse_device_list(self._conn.read_message()))
+                    backoff = TRACK_BACKOFF_MIN # Got a list - the connection works
+            except (AdbError, OSError, ValueError):
+                pass
+            finally:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+            with self._changed:
+                self.tracking = False
+                self._changed.notify_all() # Waiters switch to polling
+            self._stop.wait(backoff)
+            backoff = min(TRACK_BACKOFF_MAX, backoff * 2)
+
+    def apply(self, listed):
+        """Takes one full device list. Serials missing from it are gone ("offline")."""
+        now = time.monotonic()
+        with self._changed:
+            for serial in set(listed) | set(self.devices):
+                device = self.devices.get(serial)
+                if device is None:
+                    device = self.devices[serial] = DeviceState(serial)
+                event = device.update(listed.get(serial, "offline"), now)
+                if event == "disconnected":
+                    print(f"[{serial}] Device went {device.state}.")
+                    METRICS.inc("device_disconnects", device=serial)
+                elif event == "reconnected":
+                    print(f"[{serial}] Device back after {device.last_outage:.1f}s.")
+                    METRICS.inc("device_reconnects", device=serial)
+                    METRICS.observe("device_outage", device.last_outage, device=serial)
+                METRICS.set("device_online", int(device.ready), device=serial)
+            self.tracking = True
+            self._changed.notify_all()
+
+    def snapshot(self, timeout=2.0):
+        """{serial: state} as tracked. Waits up to `timeout` for the first list, else asks `adb devices`."""
+        with self._changed:
+            if self._changed.wait_for(lambda: self.tracking, timeout):
+                return {serial: device.state for serial, device in self.devices.items()}
+        try:
+            return dict(list_devices(self.host, self.port))
+        except Exception as e:
+            print(f"Error checking devices: {e}")
+            return {}
+
+    def ready_serial(self, serial=None):
+        """`serial` if it is ready, or any ready serial when None. None if not ready."""
+        if serial is not None:
+            device = self.devices.get(serial)
+            return serial if device is not None and device.ready else None
+        for device in self.devices.values():
+            if device.ready: return device.serial
+        return None
+
+    def wait_ready(self, serial=None, timeout=30.0, cancelled=None):
+        """Blocks until `serial` (or any device) is ready. Returns the serial, or None on timeout.
+
+        Wakes the moment the tracker sees the device. While tracking is down it polls
+        `adb devices` with exponential backoff instead. `cancelled()` is checked every second.
+        """
+        deadline = time.monotonic() + timeout
+        backoff = POLL_BACKOFF_MIN
+        while True:
+            remaining = deadline - time.monotonic()
+            with self._changed:
+                if self.tracking:
+                    found = self.ready_serial(serial)
+                    if found or remaining <= 0: return found
+                    self._changed.wait(min(1.0, remaining))
+                    if cancelled and cancelled(): return None
+                    continue
+            found = self._poll(serial)
+            if found or remaining <= 0: return found
+            if cancelled and cancelled(): return None
+            # Sleeps on the condition, so a tracker that comes back ends the wait early
+            with self._changed:
+                self._changed.wait(min(backoff, remaining))
+            backoff = min(POLL_BACKOFF_MAX, backoff * 2)
+
+    def _poll(self, serial):
+        try:
+            devices = dict(list_devices(self.host, self.port))
+        except Exception as e:
+            print(f"Error checking devices: {e}")
+            return None
+        if serial is not None:
+            return serial if devices.get(serial) == "device" else None
+        return next((s for s, state in devices.items() if state == "device"), None)
+
+    def stats(self):
+        with self._changed:
+            return {serial: device.stats() for serial, device in self.devices.items()}
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker_for(port=ADB_PORT, host=ADB_HOST):
+    """The shared, started tracker for one adb server (fleet devices share it)."""
+    with _trackers_lock:
+        tracker = _trackers.get((host, port))
+        if tracker is None:
+            tracker = _trackers[(host, port)] = DeviceTracker(host, port).start()
+        return tracker
+
+
+def main():
+    """Outage drill against a fake adb server, through the bot's own connect / reconnect path."""
+    import bot
+    import tracker # The registry bot uses - this file runs as __main__, a separate copy
+    from fake_adb import FakeAdbServer, FakeDevice
+
+    server = FakeAdbServer([FakeDevice("emulator-5554")]).start()
+    bot.SESSION.adb_port = server.port
+    try:
+        serial = bot.get_connected_device()
+        if serial is None:
+            print("FAIL: no device found on the fake server")
+            sys.exit(1)
+        bot.SESSION.serial = serial
+        devices = tracker.tracker_for(server.port)
+        for outage in (1.0, 0.5):
+            server.set_state(serial, "offline")
+            threading.Timer(outage, server.set_state, (serial, "device")).start()
+            with devices._changed: # Let the tracker see it go, as after a failed adb command
+                devices._changed.wait_for(lambda: devices.ready_serial(serial) is None, 5.0)
+            if not bot.refresh_connection():
+                print("FAIL: device did not come back")
+                sys.exit(1)
+        stats = devices.stats()[serial]
+        print(f"Devices: {devices.stats()}")
+        ok = stats["disconnects"] == 2 and stats["reconnects"] == 2 and stats["downtime_s"] >= 1.4
+        print("OK" if ok else "FAIL: outages not counted")
+        sys.exit(0 if ok else 1)
+    finally:
+        tracker.tracker_for(server.port).stop()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()